@@ -0,0 +1,188 @@
+"""Benchmark offline cho sang.py: sinh trang detail giả lập, phục vụ qua fixture server,
+đo thời gian parse / HTTP fetch / (tùy chọn) Chrome, merge và ghi file output.
+
+    python bench_sang.py
+    python bench_sang.py --sizes 10 200 2000 --repeat 5 --browser
+"""
+import os
+import io
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+
+import sang
+
+SPEC_HEADERS = ["Bore Dia. d(mm)", "Outer Dia. D(mm)", "Width B(mm)", "Material", "Seal / Shield",
+                "Basic Load Rating Cr(N)", "Allowable Rotational Speed(rpm)", "Weight(g)",
+                "Operating Temperature(°C)", "Lubrication", "Clearance", "Precision Grade"]
+
+
+# ====== SINH FIXTURE ======
+def build_product_page(product_id, rows, spec_columns):
+    """Trang detail có đủ tab Part Number và 3 bảng PartNumberColumn / AsideColumns / SpecColumns"""
+    headers = [SPEC_HEADERS[i % len(SPEC_HEADERS)] + ("" if i < len(SPEC_HEADERS) else f" {i}")
+               for i in range(spec_columns)]
+    part_rows = []
+    aside_rows = []
+    spec_rows = []
+    for r in range(rows):
+        part_number = f"B{product_id}-{r:05d}"
+        part_rows.append(
+            f'<div class="PartNumberColumn_dataRow__43D6Y"><a href="/vona2/detail/{product_id}/?HissuCode={part_number}" '
+            f'title="{part_number}">{part_number}</a></div>')
+        aside_rows.append(
+            '<div class="PartNumberAsideColumns_dataRow__OUw8N">'
+            '<div class="PartNumberAsideColumns_dataCellBase__tIm9A"><div class="PartNumberAsideColumns_data__jikjP">'
+            f'<span>{(r + 1) * 12345:,} VND</span></div></div>'
+            '<div class="PartNumberAsideColumns_dataCellBase__tIm9A PartNumberAsideColumns_daysToShipDataCell__JRaMu">'
+            f'<div class="PartNumberAsideColumns_data__jikjP"><span>{"Same day" if r % 3 == 0 else f"{r % 7 + 1} Days"}</span></div></div>'
+            '</div>')
+        cells = "".join(f'<div class="PartNumberSpecCells_data__u6ZZX">{(r * 7 + c) % 50 + 1}mm</div>'
+                        for c in range(spec_columns))
+        spec_rows.append(f'<div class="PartNumberSpecColumns_dataRow__M4B4a">{cells}</div>')
+    header_cells = "".join(f'<div class="PartNumberSpecHeader_headerCell__r3GLv"><div>{h}</div></div>' for h in headers)
+    return f"""<!DOCTYPE html>
+<html><head><title>Bench product {product_id} | MISUMI</title></head>
+<body>
+<h1>Bench product {product_id}</h1>
+<div id="detailTabs"><div><div><div><ul>
+<li>Overview</li><li>Part Number</li><li>Specifications</li>
+</ul></div></div></div></div>
+<div class="PartNumberColumn_tableBase__DK2Le">{"".join(part_rows)}</div>
+<div class="PartNumberAsideColumns_table__6fKVE">{"".join(aside_rows)}</div>
+<div class="PartNumberSpecHeader_tableBase__Y5X_f">{header_cells}</div>
+<div class="PartNumberSpecColumns_tableBase__VK5Nd">{"".join(spec_rows)}</div>
+</body></html>"""
+
+
+def build_fixtures(fixture_dir, sizes, pages_per_size):
+    """Ghi các trang giả lập vào fixture_dir, trả về list (url thật, số rows)"""
+    pages = []
+    for size in sizes:
+        spec_columns = min(40, 6 + size // 50)
+        for n in range(pages_per_size):
+            product_id = 110300000000 + size * 1000 + n
+            url = f"https://vn.misumi-ec.com/vona2/detail/{product_id}/?KWSearch=bearing&searchFlow=results2products"
+            sang.save_page_fixture(fixture_dir, url, build_product_page(product_id, size, spec_columns))
+            pages.append((url, size))
+    return pages
+
+
+# ====== ĐO ======
+def timed(func, *args):
+    # sang.py in rất nhiều log, bỏ đi để không ảnh hưởng kết quả đo
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = func(*args)
+        return time.perf_counter() - start, result
+
+
+def report(name, latencies, items):
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    return {
+        "bench": name,
+        "runs": len(latencies),
+        "total_s": round(total, 4),
+        "p50_ms": round(sang.percentile(latencies, 50) * 1000, 2),
+        "p90_ms": round(sang.percentile(latencies, 90) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        "items_per_s": round(items / total, 1) if total else 0.0,
+    }
+
+
+def bench_pages(name, pages, repeat, fetch):
+    """fetch(url) -> url_data; đo latency từng trang, throughput tính theo số rows"""
+    latencies = []
+    results = []
+    rows = 0
+    for _ in range(repeat):
+        for url, size in pages:
+            elapsed, url_data = timed(fetch, url)
+            url_row_count = max((len(v) for v in url_data.values()), default=0)
+            if url_row_count != size:
+                print(f"⚠ {name}: {url} returned {url_row_count} rows, expected {size}")
+            latencies.append(elapsed)
+            results.append((url, url_data, url_row_count))
+            rows += url_row_count
+    return report(name, latencies, rows), results
+
+
+def run(args):
+    fixture_dir = args.fixture_dir or tempfile.mkdtemp(prefix="sang-bench-")
+    pages = build_fixtures(fixture_dir, args.sizes, args.pages)
+    server, base_url = sang.start_fixture_server(fixture_dir)
+    reports = []
+    try:
+        def parse(url):
+            with open(sang.fixture_path_for_url(fixture_dir, url), encoding="utf-8") as f:
+                html = f.read()
+            part_numbers, link_numbers, prices, days_to_ship, table_heade_data = sang.parse_product_html(html, url)
+            return sang.combine_extracted_data(part_numbers, prices, days_to_ship, table_heade_data, link_numbers)
+
+        report_parse, results = bench_pages("parse_snapshot", pages, args.repeat, parse)
+        reports.append(report_parse)
+
+        report_http, _ = bench_pages("http_fetch", pages, args.repeat,
+                                     lambda url: sang.get_data_from_url_http(sang.to_fixture_url(url, base_url)))
+        reports.append(report_http)
+
+        if args.browser:
+            pool = sang.DriverPool(size=1)
+            try:
+                def browser_fetch(url):
+                    with pool.driver() as driver:
+                        return sang.get_data_from_url(driver, sang.to_fixture_url(url, base_url)) if driver else {}
+                report_browser, _ = bench_pages("browser_get_data_from_url", pages, args.repeat, browser_fetch)
+                reports.append(report_browser)
+            finally:
+                pool.close()
+
+        # Merge: nhân bản kết quả lên khoảng --merge-urls URL
+        merge_input = (results * (args.merge_urls // max(1, len(results)) + 1))[:args.merge_urls]
+        total_rows = sum(r[2] for r in merge_input)
+        latencies = []
+        df = None
+        for _ in range(args.repeat):
+            elapsed, (df, _) = timed(sang.merge_results, merge_input)
+            latencies.append(elapsed)
+        reports.append(report(f"merge_{len(merge_input)}_urls", latencies, total_rows))
+
+        out_dir = tempfile.mkdtemp(prefix="sang-bench-out-")
+        for output_format in args.formats:
+            elapsed, _ = timed(sang.write_output, df, os.path.join(out_dir, f"bench_{output_format}"), output_format)
+            reports.append(report(f"export_{output_format}", [elapsed], len(df)))
+    finally:
+        server.shutdown()
+
+    print(f"\nFixtures: {fixture_dir} ({len(pages)} pages, sizes {args.sizes})")
+    print(f"{'bench':<30}{'runs':>6}{'total_s':>10}{'p50_ms':>10}{'p90_ms':>10}{'max_ms':>10}{'rows/s':>12}")
+    for r in reports:
+        print(f"{r['bench']:<30}{r['runs']:>6}{r['total_s']:>10}{r['p50_ms']:>10}{r['p90_ms']:>10}"
+              f"{r['max_ms']:>10}{r['items_per_s']:>12}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+        print(f"✅ Đã lưu kết quả vào {args.json}")
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark cho scraper misumi (sang.py)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 500],
+                        help="số part-number rows của mỗi loại trang")
+    parser.add_argument("--pages", type=int, default=3, help="số trang cho mỗi size")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--merge-urls", type=int, default=180, help="số URL dùng cho bench merge")
+    parser.add_argument("--formats", nargs="+", default=["xlsx", "xlsx-stream", "csv", "parquet"],
+                        choices=list(sang.OUTPUT_WRITERS))
+    parser.add_argument("--browser", action="store_true", help="đo cả get_data_from_url bằng Chrome")
+    parser.add_argument("--fixture-dir", help="thư mục fixture (mặc định: thư mục tạm)")
+    parser.add_argument("--json", help="ghi kết quả ra file JSON")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
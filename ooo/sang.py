@@ -1,67 +1,897 @@
+import os
+import re
+import sys
+import csv
+import json
 import time
-import pandas as pd
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
-from bs4 import BeautifulSoup
-
-def setup_driver():
+import math
+import hashlib
+import itertools
+import argparse
+import importlib
+import functools
+import queue
+import random
+import socket
+import sqlite3
+import asyncio
+import threading
+import unicodedata
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from urllib.parse import urljoin, urlparse, urlunparse, parse_qsl, urlencode
+
+class _LazyImport:
+    """Chỉ import module (hoặc một thuộc tính của module) ở lần dùng đầu tiên
+
+    Giúp các lệnh nhẹ (liệt kê / kiểm tra URL) không phải load selenium, pandas, bs4.
+    """
+
+    def __init__(self, module, attribute=None):
+        self._module = module
+        self._attribute = attribute
+        self._value = None
+
+    def _load(self):
+        if self._value is None:
+            value = importlib.import_module(self._module)
+            self._value = getattr(value, self._attribute) if self._attribute else value
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+urllib3 = _LazyImport("urllib3")
+pd = _LazyImport("pandas")
+webdriver = _LazyImport("selenium.webdriver")
+By = _LazyImport("selenium.webdriver.common.by", "By")
+WebDriverWait = _LazyImport("selenium.webdriver.support.ui", "WebDriverWait")
+EC = _LazyImport("selenium.webdriver.support.expected_conditions")
+Options = _LazyImport("selenium.webdriver.chrome.options", "Options")
+BeautifulSoup = _LazyImport("bs4", "BeautifulSoup")
+
+# ====== CẤU HÌNH ======
+NUM_WORKERS = 1               # số Chrome worker chạy song song
+DRIVER_MAX_PAGES = 25         # recycle driver sau N trang
+DRIVER_MAX_RSS_MB = 1500      # recycle driver khi chromedriver + Chrome dùng quá mức RAM này (None = tắt)
+MEMORY_CHECK_INTERVAL = 60    # giây giữa 2 lần watchdog ghi log RAM
+WAIT_POLL_INTERVAL = 0.25     # chu kỳ kiểm tra điều kiện chờ (giây)
+WAIT_STABLE_TIME = 0.75       # số row / số request phải đứng yên bao lâu mới coi là xong
+
+PART_NUMBER_ROW_CLASS = "PartNumberColumn_dataRow__43D6Y"
+ASIDE_ROW_CLASS = "PartNumberAsideColumns_dataRow__OUw8N"
+SPEC_ROW_CLASS = "PartNumberSpecColumns_dataRow__M4B4a"
+
+# "snapshot": lấy outerHTML một lần rồi parse bằng BeautifulSoup
+# "webdriver": dùng các extractor cũ (find_element từng ô)
+EXTRACTION_MODE = "snapshot"
+
+SELECTOR_STATS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "selector_stats.json")
+SELECTOR_PROBE_TIMEOUT = 2    # giây cho mỗi selector sau khi trang đã có ít nhất một selector khớp
+
+STREAM_LARGE_TABLES = True    # bảng Part Number ảo hóa / phân trang: scroll qua hết bảng để lấy đủ rows
+STREAM_MAX_STEPS = 1000       # số lần scroll / chuyển trang tối đa cho một bảng
+
+URL_COLUMN = 'Product URL'
+# Query param chỉ để tracking, bỏ đi để cùng một sản phẩm không bị scrape 2 lần
+TRACKING_QUERY_PARAMS = {"KWSearch", "searchFlow", "list", "gclid", "fbclid"}
+# Chia input cho nhiều máy/process: máy thứ SHARD_INDEX (0..NUM_SHARDS-1) chỉ chạy shard của nó
+NUM_SHARDS = 1
+SHARD_INDEX = 0
+
+# Fan-out: sau khi crawl xong, mở link chi tiết của từng part number (lưu ra <name>_variants)
+FOLLOW_PART_LINKS = False
+FOLLOW_MAX_DEPTH = 1          # 1 = chỉ mở link trên trang sản phẩm, 2 = mở tiếp link trên trang part...
+FOLLOW_MAX_LINKS_PER_PAGE = 20
+FOLLOW_BLOOM_CAPACITY = 1_000_000   # số URL dự kiến cho bộ lọc trùng
+FOLLOW_BLOOM_ERROR_RATE = 0.001
+
+# Phân loại trang ngay sau driver.get: trang không phải sản phẩm thì bỏ qua, trang lỗi / captcha thì retry
+PRODUCT_URL_PATTERN = r"/vona2/detail/"
+BOT_CHALLENGE_MARKERS = ["captcha", "verify you are human", "are you a robot", "just a moment",
+                         "access denied", "unusual traffic", "request blocked", "attention required"]
+ERROR_PAGE_MARKERS = ["bad gateway", "service unavailable", "internal server error", "gateway timeout",
+                      "under maintenance", "too many requests"]
+NOT_FOUND_PATTERN = r"\b404\b|not found|không tìm thấy|no longer available"
+
+# "browser": luôn dùng Chrome; "http": tải HTML qua HTTP trước, chỉ mở Chrome khi không đọc được
+FETCH_MODE = "browser"
+HTTP_POOL_SIZE = 10           # số connection giữ sẵn mỗi host
+HTTP_TIMEOUT = 30
+FIXTURE_RECORD_DIR = None     # đặt thư mục để lưu snapshot các trang đã scrape làm fixture
+
+RATE_LIMIT_PER_HOST = 1.0     # số request/giây cho mỗi host (token bucket)
+RATE_LIMIT_BURST = 3
+MAX_RETRIES = 2               # số lần thử lại một URL không lấy được rows
+RETRY_BASE_DELAY = 10         # giây, nhân đôi mỗi lần thử lại (có jitter)
+RETRY_MAX_DELAY = 120
+OUTPUT_FORMAT = "xlsx"         # xlsx | xlsx-stream | csv | parquet | feather
+# Đặt số URL mỗi file để ghi thành nhiều partition thay vì 1 file. Với run lớn trên máy ít RAM nên bật:
+# mỗi lần chỉ đọc một batch từ checkpoint, còn ghi 1 file thì phải gộp cả bảng trong RAM
+OUTPUT_PARTITION_SIZE = None
+# File output lần chạy trước: bật chế độ chỉ ghi các dòng thay đổi (<name>_delta). Chỉ được đọc khi
+# chưa có <name>_baseline; từ đó mỗi lần chạy so với <name>_baseline rồi ghi đè nó bằng kết quả mới
+DIFF_PREVIOUS_OUTPUT = None
+DIFF_KEY_COLUMNS = ["Part Number"]
+DIFF_COLUMNS = ["Price", "Days to Ship"]
+PAGE_CACHE_DIR = None         # đặt thư mục để bật cache dữ liệu đã trích xuất theo URL
+PAGE_CACHE_TTL = 24 * 3600    # giây
+PAGE_CACHE_MAX_BYTES = 500 * 1024 * 1024
+# "ttl": dữ liệu còn hạn thì không mở trang; "conditional": luôn mở trang nhưng chỉ parse lại khi HTML các bảng đổi
+PAGE_CACHE_REFRESH = "ttl"
+# Thêm cột số "Price Value" / "Days to Ship Value" và dùng category cho các cột lặp lại nhiều
+TYPED_COLUMNS = True
+# Cột spec mà mọi ô đều là số cùng một đơn vị ("10mm", "12 mm") đổi thành cột số "<cột> [mm]"
+SPEC_NUMERIC_COLUMNS = False
+CATEGORY_MAX_RATIO = 0.5      # cột text có số giá trị khác nhau / số rows nhỏ hơn mức này thì chuyển sang category
+# True: chạy tiếp lần chạy bị dừng, bỏ qua các URL đã có kết quả trong file checkpoint .progress.jsonl
+# False: xóa checkpoint cũ và scrape lại tất cả (lần chạy hằng ngày cần giá mới)
+RESUME = False
+# File SQLite trên ổ local làm hàng đợi URL cho nhiều worker process trên CÙNG một máy; None = không dùng.
+# Không đặt trên ổ mạng (SMB/NFS): WAL và file lock của SQLite không hoạt động đúng ở đó.
+# Chạy nhiều máy thì chia input bằng NUM_SHARDS / --shard.
+# Worker chỉ xử lý URL; output ghi một lần bằng lệnh merge hoặc một worker chạy với --export.
+WORK_QUEUE_PATH = None
+QUEUE_VISIBILITY_TIMEOUT = 300  # giây; worker chết giữa chừng thì URL được trả lại hàng đợi sau thời gian này
+QUEUE_MAX_ATTEMPTS = 3          # số lần lease tối đa trước khi URL vào dead-letter
+QUEUE_POLL_INTERVAL = 2         # giây chờ khi chưa lease được URL nào
+# Các worker cùng run id dùng chung hàng đợi; run id khác thì hàng đợi được xóa và scrape lại từ đầu
+# (--resume để giữ kết quả cũ). None = ngày hôm nay, mỗi ngày một lần chạy lấy giá mới.
+QUEUE_RUN_ID = None
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+# "production": headless, chặn ảnh/font/media/analytics; "debug": Chrome có giao diện, tải đủ mọi thứ
+BROWSER_PROFILE = "production"
+CHROME_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".chrome-cache")
+BLOCK_STYLESHEETS = False     # chặn cả CSS (nhanh hơn nhưng có trang không click được tab)
+BLOCKED_URL_PATTERNS = [
+    # ảnh, font, media
+    "*.png*", "*.jpg*", "*.jpeg*", "*.gif*", "*.webp*", "*.svg*", "*.ico*",
+    "*.woff*", "*.ttf*", "*.otf*", "*.eot*",
+    "*.mp4*", "*.webm*", "*.mp3*",
+    # analytics / quảng cáo / bên thứ ba
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*googleadservices.com*", "*facebook.net*", "*facebook.com/tr*", "*hotjar.com*",
+    "*clarity.ms*", "*bing.com*", "*criteo.*", "*adobedtm.com*", "*demdex.net*",
+    "*omtrdc.net*", "*linkedin.com*", "*tiktok.com*", "*yimg.jp*",
+]
+
+# ====== ĐO THỜI GIAN TỪNG STAGE ======
+def percentile(sorted_values, q):
+    """Percentile theo nearest-rank trên list đã sort"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+class RunProfiler:
+    """Ghi thời gian từng stage theo URL (thread-safe) và đếm số lệnh gửi tới chromedriver
+
+    kind="wait" đánh dấu thời gian ngồi chờ trang, phần còn lại của url_total là thời gian làm việc.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.webdriver_calls = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def current_url(self):
+        return getattr(self._local, "url", None)
+
+    @contextmanager
+    def url(self, url):
+        previous = self.current_url
+        self._local.url = url
+        try:
+            with self.stage("url_total"):
+                yield
+        finally:
+            self._local.url = previous
+
+    @contextmanager
+    def stage(self, name, kind="work"):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.records.append({"url": self.current_url, "stage": name, "kind": kind, "seconds": elapsed})
+
+    def instrument_driver(self, driver):
+        """Bọc driver.execute để đếm số lệnh WebDriver theo URL"""
+        original_execute = driver.execute
+
+        def execute(driver_command, params=None):
+            url = self.current_url
+            with self._lock:
+                self.webdriver_calls[url] = self.webdriver_calls.get(url, 0) + 1
+            return original_execute(driver_command, params)
+
+        driver.execute = execute
+        return driver
+
+    def per_url(self):
+        urls = {}
+        with self._lock:
+            records = list(self.records)
+            calls = dict(self.webdriver_calls)
+        for record in records:
+            if record["url"] is None:
+                continue
+            entry = urls.setdefault(record["url"], {"total": 0.0, "wait": 0.0, "stages": {}})
+            if record["stage"] == "url_total":
+                entry["total"] += record["seconds"]
+            else:
+                entry["stages"][record["stage"]] = entry["stages"].get(record["stage"], 0.0) + record["seconds"]
+                if record["kind"] == "wait":
+                    entry["wait"] += record["seconds"]
+        for url, entry in urls.items():
+            entry["work"] = max(0.0, entry["total"] - entry["wait"])
+            entry["webdriver_calls"] = calls.get(url, 0)
+        return urls
+
+    def summary(self):
+        stages = {}
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            stages.setdefault(record["stage"], []).append(record["seconds"])
+        result = {}
+        for name, values in stages.items():
+            values.sort()
+            result[name] = {
+                "count": len(values),
+                "total": sum(values),
+                "p50": percentile(values, 50),
+                "p90": percentile(values, 90),
+                "p99": percentile(values, 99),
+                "max": values[-1],
+            }
+        return result
+
+    def write(self, name_file_to_save):
+        """Ghi <name>.profile.json (summary + từng URL) và <name>.profile.csv (từng record)"""
+        with open(name_file_to_save + ".profile.json", "w", encoding="utf-8") as f:
+            json.dump({"stages": self.summary(), "urls": self.per_url()}, f, ensure_ascii=False, indent=2)
+        with self._lock:
+            records = list(self.records)
+        with open(name_file_to_save + ".profile.csv", "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=["url", "stage", "kind", "seconds"])
+            writer.writeheader()
+            writer.writerows(records)
+
+    def print_summary(self):
+        print("\n=== Run profile ===")
+        print(f"{'stage':<24}{'count':>7}{'total':>10}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+        for name, stats in sorted(self.summary().items(), key=lambda item: -item[1]["total"]):
+            print(f"{name:<24}{stats['count']:>7}{stats['total']:>10.1f}{stats['p50']:>9.2f}"
+                  f"{stats['p90']:>9.2f}{stats['p99']:>9.2f}{stats['max']:>9.2f}")
+        urls = self.per_url()
+        if urls:
+            total_wait = sum(entry["wait"] for entry in urls.values())
+            total_work = sum(entry["work"] for entry in urls.values())
+            total_calls = sum(entry["webdriver_calls"] for entry in urls.values())
+            print(f"Wait time: {total_wait:.1f}s, work time: {total_work:.1f}s, WebDriver calls: {total_calls}")
+            slowest = sorted(urls.items(), key=lambda item: -item[1]["total"])[:5]
+            print("Slowest URLs:")
+            for url, entry in slowest:
+                print(f"  {entry['total']:.1f}s (wait {entry['wait']:.1f}s, {entry['webdriver_calls']} calls) {url}")
+
+PROFILER = RunProfiler()
+
+def profiled(stage_name, kind="work"):
+    """Decorator: đo cả hàm như một stage của PROFILER"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with PROFILER.stage(stage_name, kind):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@profiled("driver_startup")
+def setup_driver(profile=None):
+    profile = profile or BROWSER_PROFILE
     chrome_options = Options()
-    # Tạm thời disable headless để debug
-    # chrome_options.add_argument("--headless")
+    if profile == "production":
+        chrome_options.add_argument("--headless=new")
+        chrome_options.add_argument("--disable-extensions")
+        chrome_options.add_argument("--mute-audio")
+        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+        if CHROME_CACHE_DIR:
+            chrome_options.add_argument(f"--disk-cache-dir={CHROME_CACHE_DIR}")
+        chrome_options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.default_content_setting_values.notifications": 2,
+        })
+    # profile "debug": giữ Chrome có giao diện để xem trực tiếp
     chrome_options.add_argument("--no-sandbox")
     chrome_options.add_argument("--disable-dev-shm-usage")
     chrome_options.add_argument("--disable-gpu")
     chrome_options.add_argument("--window-size=1920,1080")
-    chrome_options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
+    chrome_options.add_argument(f"--user-agent={USER_AGENT}")
     chrome_options.add_argument("--disable-blink-features=AutomationControlled")
     chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
     chrome_options.add_experimental_option('useAutomationExtension', False)
     try:
         driver = webdriver.Chrome(options=chrome_options)
         driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+        if profile == "production":
+            block_resources(driver)
         return driver
     except Exception as e:
         print(f"Error setting up Chrome driver: {e}")
         return None
 
-# ====== HÀM LẤY DANH SÁCH PART NUMBER ======
-def extract_all_part_numbers(driver):
-    wait = WebDriverWait(driver, 60)
-    time.sleep(5)
-    # Scroll to trigger lazy loading
+def block_resources(driver):
+    """Chặn request ảnh/font/media/analytics qua CDP (áp dụng cho cả session)"""
+    patterns = list(BLOCKED_URL_PATTERNS)
+    if BLOCK_STYLESHEETS:
+        patterns.append("*.css*")
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+    except Exception as e:
+        print(f"Could not enable request blocking: {e}")
+
+# ====== ĐO RAM (PSUTIL NẾU CÓ, /proc NẾU KHÔNG) ======
+MB = 1024 * 1024
+
+@functools.lru_cache(maxsize=None)
+def _load_psutil():
+    try:
+        import psutil
+        return psutil
+    except ImportError:
+        return None
+
+_memory_warning_shown = False
+
+def memory_measurable():
+    """Đo được RSS không; in cảnh báo một lần nếu không (Windows / macOS chưa cài psutil)"""
+    global _memory_warning_shown
+    if _load_psutil() or os.path.isdir("/proc"):
+        return True
+    if not _memory_warning_shown:
+        _memory_warning_shown = True
+        print("⚠ Cannot measure memory: psutil is not installed and /proc is not available. "
+              "Run 'pip install psutil' to enable DRIVER_MAX_RSS_MB recycling and the memory watchdog.")
+    return False
+
+def _proc_children():
+    """{ppid: [pid con]} đọc từ /proc/*/stat"""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # Tên process nằm trong ngoặc và có thể chứa dấu cách: lấy phần sau dấu ')' cuối cùng
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+def process_rss(pid, include_children=False):
+    """RSS (byte) của pid, cộng cả các process con nếu include_children; None nếu không đo được"""
+    psutil = _load_psutil()
+    if psutil:
+        try:
+            process = psutil.Process(pid)
+            processes = [process] + (process.children(recursive=True) if include_children else [])
+        except psutil.Error:
+            return None
+        total = 0
+        for process in processes:
+            try:
+                total += process.memory_info().rss
+            except psutil.Error:
+                continue
+        return total
+    if not memory_measurable() or not os.path.isdir(f"/proc/{pid}"):
+        return None
+    pids = [pid]
+    if include_children:
+        children = _proc_children()
+        stack = [pid]
+        while stack:
+            for child in children.get(stack.pop(), []):
+                pids.append(child)
+                stack.append(child)
+    total = 0
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    for process_id in pids:
+        try:
+            with open(f"/proc/{process_id}/statm") as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, ValueError, IndexError):
+            continue
+    return total
+
+def driver_rss(driver):
+    """RAM của chromedriver và các process Chrome con của nó"""
+    process = getattr(getattr(driver, "service", None), "process", None)
+    pid = getattr(process, "pid", None)
+    return process_rss(pid, include_children=True) if pid else None
+
+# ====== POOL CHROME DRIVER ======
+class DriverPool:
+    """Giữ sẵn các Chrome session để tái sử dụng giữa các URL"""
+
+    def __init__(self, size=NUM_WORKERS, max_pages=DRIVER_MAX_PAGES, driver_factory=None, max_rss_mb=None):
+        self.size = max(1, size)
+        self.max_pages = max_pages
+        self.max_rss_mb = DRIVER_MAX_RSS_MB if max_rss_mb is None else max_rss_mb
+        if self.max_rss_mb and not memory_measurable():
+            self.max_rss_mb = None
+        self.driver_factory = driver_factory or setup_driver
+        self._idle = queue.Queue()
+        self._pages = {}
+        self._drivers = {}
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+    def _new_driver(self):
+        driver = self.driver_factory()
+        if driver:
+            PROFILER.instrument_driver(driver)
+            with self._lock:
+                self._pages[id(driver)] = 0
+                self._drivers[id(driver)] = driver
+            try:
+                driver.maximize_window()
+            except Exception:
+                pass
+        return driver
+
+    def _is_alive(self, driver):
+        try:
+            driver.execute_script("return 1")
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, driver):
+        with self._lock:
+            self._pages.pop(id(driver), None)
+            self._drivers.pop(id(driver), None)
+            self._created -= 1
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def acquire(self, timeout=None):
+        """Mượn một driver còn sống, tạo mới nếu pool chưa đầy"""
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    driver = self._new_driver()
+                    if not driver:
+                        with self._lock:
+                            self._created -= 1
+                        return None
+                    return driver
+                try:
+                    driver = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    return None
+            if self._is_alive(driver):
+                return driver
+            print("Driver session died, replacing it")
+            self._discard(driver)
+
+    def release(self, driver, broken=False):
+        """Trả driver về pool; quit nếu hỏng hoặc đã dùng quá max_pages"""
+        if driver is None:
+            return
+        with self._lock:
+            pages = self._pages.get(id(driver), 0) + 1
+            self._pages[id(driver)] = pages
+        if broken or self._closed:
+            self._discard(driver)
+            return
+        if self.max_pages and pages >= self.max_pages:
+            print(f"Recycling driver after {pages} pages")
+            self._discard(driver)
+            return
+        if self.max_rss_mb:
+            # RAM của Chrome tăng dần theo số trang đã mở, recycle trước khi máy bị OOM
+            rss = driver_rss(driver)
+            if rss and rss > self.max_rss_mb * MB:
+                print(f"Recycling driver using {rss / MB:.0f} MB after {pages} pages")
+                self._discard(driver)
+                return
+        self._idle.put(driver)
+
+    def drivers_rss(self):
+        """Tổng RAM của mọi driver đang mở (None nếu không đo được)"""
+        with self._lock:
+            drivers = list(self._drivers.values())
+        sizes = [rss for rss in (driver_rss(driver) for driver in drivers) if rss is not None]
+        return sum(sizes) if sizes else None
+
+    @contextmanager
+    def driver(self):
+        """Mượn driver trong khối with; session chết sẽ bị thay khi trả về"""
+        driver = self.acquire()
+        try:
+            yield driver
+        finally:
+            if driver is not None:
+                self.release(driver, broken=not self._is_alive(driver))
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(driver)
+
+class MemoryWatchdog:
+    """Thread nền ghi log RAM của process Python và các Chrome trong pool, giữ lại mức cao nhất"""
+
+    def __init__(self, pool=None, interval=None):
+        self.pool = pool
+        self.interval = MEMORY_CHECK_INTERVAL if interval is None else interval
+        self.peak_python = 0
+        self.peak_drivers = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        python_rss = process_rss(os.getpid()) or 0
+        drivers_rss = (self.pool.drivers_rss() if self.pool else None) or 0
+        self.peak_python = max(self.peak_python, python_rss)
+        self.peak_drivers = max(self.peak_drivers, drivers_rss)
+        return python_rss, drivers_rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            python_rss, drivers_rss = self.sample()
+            print(f"Memory: python {python_rss / MB:.0f} MB, Chrome {drivers_rss / MB:.0f} MB")
+
+    def __enter__(self):
+        # Không đo được RAM thì không chạy thread, tránh log toàn 0 MB
+        if memory_measurable():
+            self.sample()
+            self._thread = threading.Thread(target=self._run, name="memory-watchdog", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+        print(f"Peak memory: python {self.peak_python / MB:.0f} MB, Chrome {self.peak_drivers / MB:.0f} MB")
+
+# ====== CHỜ THEO ĐIỀU KIỆN ======
+# Các giá trị time.sleep cũ giờ chỉ là timeout tối đa, hàm trả về ngay khi DOM sẵn sàng
+def wait_until(condition, timeout, poll=WAIT_POLL_INTERVAL):
+    """Gọi condition() cho đến khi trả về giá trị truthy hoặc hết timeout"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            result = condition()
+            if result:
+                return result
+        except Exception:
+            pass
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(poll)
+
+# Buffer resource timing mặc định chỉ giữ 250 entry, đầy rồi thì length đứng yên
+# dù trang vẫn tải. Lần gọi đầu trên mỗi trang (window mới) nới buffer và khi vẫn
+# đầy thì cộng dồn số entry vào bộ đếm rồi clear, nên tổng luôn tăng theo request.
+_RESOURCE_COUNT_JS = """
+if (!window.__sangResources) {
+    window.__sangResources = {seen: 0};
+    performance.setResourceTimingBufferSize(10000);
+    performance.addEventListener('resourcetimingbufferfull', function () {
+        window.__sangResources.seen += performance.getEntriesByType('resource').length;
+        performance.clearResourceTimings();
+    });
+}
+return [document.readyState,
+        window.__sangResources.seen + performance.getEntriesByType('resource').length];
+"""
+
+@profiled("wait_network_idle", kind="wait")
+def wait_for_network_idle(driver, timeout, idle_time=WAIT_STABLE_TIME):
+    """Chờ document load xong và không có resource mới trong idle_time giây"""
+    deadline = time.monotonic() + timeout
+    last_count = None
+    last_change = time.monotonic()
+    while time.monotonic() < deadline:
+        try:
+            state, count = driver.execute_script(_RESOURCE_COUNT_JS)
+        except Exception:
+            state, count = None, None
+        now = time.monotonic()
+        if count != last_count or state != "complete":
+            last_count = count
+            last_change = now
+        elif now - last_change >= idle_time:
+            return True
+        time.sleep(WAIT_POLL_INTERVAL)
+    return False
+
+@profiled("wait_rows", kind="wait")
+def wait_for_stable_rows(driver, row_class, timeout, stable_time=WAIT_STABLE_TIME, min_rows=1):
+    """Chờ bảng có row_class xuất hiện và số row không đổi trong stable_time giây"""
+    deadline = time.monotonic() + timeout
+    last_count = -1
+    last_change = time.monotonic()
+    while time.monotonic() < deadline:
+        try:
+            count = driver.execute_script(
+                "return document.getElementsByClassName(arguments[0]).length;", row_class
+            )
+        except Exception:
+            count = -1
+        now = time.monotonic()
+        if count != last_count:
+            last_count = count
+            last_change = now
+        elif count >= min_rows and now - last_change >= stable_time:
+            return count
+        time.sleep(WAIT_POLL_INTERVAL)
+    return max(last_count, 0)
+
+def scroll_for_lazy_load(driver, timeout):
+    """Scroll xuống cuối rồi lên đầu để kích hoạt lazy loading"""
     driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-    time.sleep(2)
+    wait_for_network_idle(driver, timeout)
     driver.execute_script("window.scrollTo(0, 0);")
-    time.sleep(2)
+    wait_for_network_idle(driver, timeout)
+
+# ====== SELECTOR REGISTRY (NHỚ SELECTOR NÀO ĐANG DÙNG ĐƯỢC) ======
+class SelectorRegistry:
+    """Thống kê thành công/thất bại của từng selector theo (domain, nhóm), lưu ra file JSON"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._stats = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._stats is None:
+            self._stats = {}
+            if self.path and os.path.exists(self.path):
+                try:
+                    with open(self.path, encoding="utf-8") as f:
+                        self._stats = json.load(f)
+                except (OSError, ValueError) as e:
+                    print(f"Could not read selector stats {self.path}: {e}")
+        return self._stats
+
+    @staticmethod
+    def _key(selector):
+        return selector if isinstance(selector, str) else f"{selector[0]}={selector[1]}"
+
+    def _rate(self, group_stats, selector):
+        success, failure = group_stats.get(self._key(selector), (0, 0))
+        return (success + 1) / (success + failure + 2)
+
+    def ordered(self, domain, group, selectors):
+        """Selector có tỉ lệ thành công cao nhất lên trước, hòa thì giữ thứ tự gốc"""
+        with self._lock:
+            group_stats = self._load().get(f"{domain}|{group}", {})
+            return sorted(selectors, key=lambda selector: -self._rate(group_stats, selector))
+
+    def record(self, domain, group, selector, success):
+        with self._lock:
+            group_stats = self._load().setdefault(f"{domain}|{group}", {})
+            counts = group_stats.setdefault(self._key(selector), [0, 0])
+            counts[0 if success else 1] += 1
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if self._stats is None:
+                return
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._stats, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+
+SELECTOR_REGISTRY = SelectorRegistry(SELECTOR_STATS_FILE)
+
+@profiled("wait_selector", kind="wait")
+def wait_for_any_selector(driver, locators, timeout):
+    """Chờ (tối đa timeout) đến khi có ít nhất một locator tìm thấy phần tử"""
+    return wait_until(lambda: any(driver.find_elements(by, selector) for by, selector in locators), timeout)
+
+# ====== MỞ TAB PART NUMBER (MỘT LẦN CHO CẢ 3 BẢNG) ======
+PART_NUMBER_TAB_SELECTORS = [
+    "//*[@id='detailTabs']/div/div/div/ul/li[2]",
+    "//li[contains(text(), 'Part Number')]",
+    "//a[contains(text(), 'Part Number')]",
+    "//button[contains(text(), 'Part Number')]",
+    "//div[contains(@class, 'tab') and contains(text(), 'Part Number')]",
+    "//span[contains(text(), 'Part Number')]"
+]
+
+@profiled("tab_click")
+def open_part_number_tab(driver):
+    """Click tab Part Number, thử các selector theo thứ tự đã học; trả về True nếu click được"""
+    domain = urlparse(driver.current_url).netloc
+    selectors = SELECTOR_REGISTRY.ordered(domain, "part_number_tab", PART_NUMBER_TAB_SELECTORS)
+    # Chờ dài một lần cho đến khi có selector nào đó khớp, sau đó mỗi selector chỉ probe ngắn
+    wait_for_any_selector(driver, [(By.XPATH, selector) for selector in selectors], 60)
+    wait = WebDriverWait(driver, SELECTOR_PROBE_TIMEOUT)
+    for i, selector in enumerate(selectors):
+        try:
+            print(f"Trying dropdown selector {i+1}: {selector}")
+            dropdown_btn = wait.until(EC.element_to_be_clickable((By.XPATH, selector)))
+            driver.execute_script("arguments[0].scrollIntoView(true);", dropdown_btn)
+            dropdown_btn.click()
+            wait_for_stable_rows(driver, SPEC_ROW_CLASS, 5)
+            print(f"Successfully clicked dropdown button with selector {i+1}")
+            SELECTOR_REGISTRY.record(domain, "part_number_tab", selector, True)
+            return True
+        except Exception as e:
+            print(f"Selector {i+1} failed: {e}")
+            SELECTOR_REGISTRY.record(domain, "part_number_tab", selector, False)
+            continue
 
-    # Click vào tab Part Number (nếu chưa được click)
+    print("All dropdown selectors failed, trying to find any clickable elements...")
     try:
-        dropdown_btn = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[@id='detailTabs']/div/div/div/ul/li[2]")))
-        time.sleep(3)
-        dropdown_btn.click()
-        time.sleep(5)
-        print("Clicked Part Number tab")
+        # Tìm tất cả các phần tử có thể click
+        clickable_elements = driver.find_elements(By.XPATH, "//*[contains(@class, 'tab') or contains(@class, 'button') or contains(@class, 'link')]")
+        print(f"Found {len(clickable_elements)} potentially clickable elements")
+        
+        for i, elem in enumerate(clickable_elements[:5]):  # Thử 5 phần tử đầu tiên
+            try:
+                text = elem.text.strip()
+                print(f"Element {i+1}: '{text}'")
+                if 'part' in text.lower() or 'number' in text.lower():
+                    driver.execute_script("arguments[0].scrollIntoView(true);", elem)
+                    elem.click()
+                    wait_for_stable_rows(driver, SPEC_ROW_CLASS, 5)
+                    print(f"Clicked element with text: '{text}'")
+                    return True
+            except Exception as e:
+                print(f"Failed to click element {i+1}: {e}")
+                continue
+    except Exception as e:
+        print(f"Failed to find clickable elements: {e}")
+    return False
+
+# ====== PHÂN LOẠI TRANG (FAST-FAIL) ======
+class SkipPage(Exception):
+    """Trang không phải trang sản phẩm: bỏ qua URL, không retry"""
+
+_PAGE_INFO_JS = """
+const body = document.body ? document.body.innerText : '';
+return {
+    url: location.href,
+    title: document.title || '',
+    hasTabs: !!document.getElementById('detailTabs'),
+    hasChallenge: !!document.querySelector(
+        'iframe[src*="captcha"], .g-recaptcha, .h-captcha, #challenge-form, #cf-challenge-running'),
+    text: body.slice(0, 2000),
+};
+"""
+
+def classify_page(info):
+    """Trả về (loại trang, lý do): "product" | "loading" | "blocked" | "error" | "not_product"
+
+    info là dict url / title / hasTabs / hasChallenge / text (xem _PAGE_INFO_JS).
+    """
+    title = info.get("title", "").lower()
+    text = info.get("text", "").lower()
+    is_product_url = bool(re.search(PRODUCT_URL_PATTERN, info.get("url", "")))
+    if info.get("hasChallenge"):
+        return "blocked", f"bot challenge on {info.get('url')}"
+    if info.get("hasTabs"):
+        return "product", ""
+    # Body của trang sản phẩm đang load có thể chứa "please wait" / "captcha" trong
+    # form hay script: chỉ tin marker trong body khi URL cũng đã bị đẩy khỏi trang sản phẩm
+    if any(marker in title for marker in BOT_CHALLENGE_MARKERS) or (
+            not is_product_url and any(marker in text for marker in BOT_CHALLENGE_MARKERS)):
+        return "blocked", f"bot challenge on {info.get('url')}"
+    if any(marker in title for marker in ERROR_PAGE_MARKERS):
+        return "error", f"error page: {info.get('title')}"
+    if re.search(NOT_FOUND_PATTERN, title):
+        return "not_product", f"not found: {info.get('title')}"
+    if not is_product_url:
+        return "not_product", f"redirected to non-product page {info.get('url')}"
+    # Trang sản phẩm nhưng tab chưa render xong: để các bước chờ bình thường xử lý
+    return "loading", ""
+
+@profiled("classify_page")
+def check_page(driver):
+    """Phân loại trang vừa mở bằng một lệnh WebDriver
+
+    Raise SkipPage nếu không phải trang sản phẩm; trả về False nếu nên retry (captcha / lỗi server).
+    """
+    try:
+        info = driver.execute_script(_PAGE_INFO_JS) or {}
     except Exception as e:
-        print(f"Could not click Part Number tab: {e}")
+        print(f"Could not classify page: {e}")
+        return True
+    page_class, reason = classify_page(info)
+    if page_class == "not_product":
+        raise SkipPage(reason)
+    if page_class in ("blocked", "error"):
+        print(f"⚠ {reason}, will retry later")
+        return False
+    return True
+
+def prepare_product_page(driver):
+    """Chuẩn bị trang một lần: chờ load, scroll lazy loading, mở tab Part Number"""
+    wait_for_network_idle(driver, 10)
+    scroll_for_lazy_load(driver, 3)
+    print("Current URL:", driver.current_url)
+    print("Page title:", driver.title)
+    return open_part_number_tab(driver)
+
+# ====== HÀM LẤY DANH SÁCH PART NUMBER ======
+# Giá trị của By.CLASS_NAME / By.CSS_SELECTOR / By.XPATH, viết sẵn để load module không cần import selenium
+PART_TABLE_SELECTORS = [
+    ("class name", "PartNumberColumn_tableBase__DK2Le"),
+    ("css selector", "[class*='PartNumberColumn'][class*='table']"),
+    ("xpath", "//table[contains(@class, 'PartNumber')]"),
+    ("xpath", "//div[contains(@class, 'PartNumber') and contains(@class, 'table')]"),
+    ("xpath", "//div[contains(@class, 'table')]//a[contains(@href, 'detail')]")
+]
+
+@profiled("extract_part_numbers")
+def extract_all_part_numbers(driver, tab_opened=None):
+    """tab_opened=None: tự scroll và click tab; True/False: trang đã được prepare_product_page"""
+    wait = WebDriverWait(driver, 60)
+    if tab_opened is None:
+        wait_for_network_idle(driver, 5)
+        # Scroll to trigger lazy loading
+        scroll_for_lazy_load(driver, 2)
+
+        # Click vào tab Part Number (nếu chưa được click)
+        try:
+            dropdown_btn = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[@id='detailTabs']/div/div/div/ul/li[2]")))
+            dropdown_btn.click()
+            wait_for_stable_rows(driver, PART_NUMBER_ROW_CLASS, 5)
+            print("Clicked Part Number tab")
+        except Exception as e:
+            print(f"Could not click Part Number tab: {e}")
+            return [], []
+    elif not tab_opened:
         return [], []
 
     part_numbers = []
     link_numbers = []
     
-    # Thử nhiều cách khác nhau để tìm bảng Part Number
-    part_table_selectors = [
-        (By.CLASS_NAME, "PartNumberColumn_tableBase__DK2Le"),
-        (By.CSS_SELECTOR, "[class*='PartNumberColumn'][class*='table']"),
-        (By.XPATH, "//table[contains(@class, 'PartNumber')]"),
-        (By.XPATH, "//div[contains(@class, 'PartNumber') and contains(@class, 'table')]"),
-        (By.XPATH, "//div[contains(@class, 'table')]//a[contains(@href, 'detail')]")
-    ]
+    # Thử nhiều cách khác nhau để tìm bảng Part Number (selector hay thành công được thử trước)
+    domain = urlparse(driver.current_url).netloc
+    part_table_selectors = SELECTOR_REGISTRY.ordered(domain, "part_number_table", PART_TABLE_SELECTORS)
+    wait_for_any_selector(driver, part_table_selectors, 60)
+    wait = WebDriverWait(driver, SELECTOR_PROBE_TIMEOUT)
     
     table_found = False
     for i, (selector_type, selector) in enumerate(part_table_selectors):
+        selector_part_count = len(part_numbers)
         try:
             print(f"Trying Part Number table selector {i+1}: {selector}")
             if selector_type == By.XPATH and "//a[contains(@href, 'detail')]" in selector:
@@ -83,10 +913,11 @@ def extract_all_part_numbers(driver):
                 if part_numbers:
                     table_found = True
                     print(f"Extracted {len(part_numbers)} part numbers from links")
+                    SELECTOR_REGISTRY.record(domain, "part_number_table", (selector_type, selector), True)
                     break
             else:
                 table_part_number = wait.until(EC.presence_of_element_located((selector_type, selector)))
-                part_elements = table_part_number.find_elements(By.CLASS_NAME, "PartNumberColumn_dataRow__43D6Y")
+                part_elements = table_part_number.find_elements(By.CLASS_NAME, PART_NUMBER_ROW_CLASS)
                 
                 if not part_elements:
                     # Thử tìm với selector khác
@@ -110,11 +941,13 @@ def extract_all_part_numbers(driver):
                 if part_numbers:
                     table_found = True
                     print(f"Extracted {len(part_numbers)} part numbers from table")
+                    SELECTOR_REGISTRY.record(domain, "part_number_table", (selector_type, selector), True)
                     break
                     
         except Exception as e:
             print(f"Selector {i+1} failed: {e}")
-            continue
+        if len(part_numbers) == selector_part_count:
+            SELECTOR_REGISTRY.record(domain, "part_number_table", (selector_type, selector), False)
     
     if not table_found:
         print("Could not find Part Number table, trying alternative approach...")
@@ -142,24 +975,24 @@ def extract_all_part_numbers(driver):
     return part_numbers, link_numbers
 
 
-def get_data_prices_days_ship(driver):
+@profiled("extract_prices_days_ship")
+def get_data_prices_days_ship(driver, tab_opened=None):
     wait = WebDriverWait(driver, 60)
-    time.sleep(5)
-    # Scroll to trigger lazy loading
-    driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-    time.sleep(2)
-    driver.execute_script("window.scrollTo(0, 0);")
-    time.sleep(2)
+    if tab_opened is None:
+        wait_for_network_idle(driver, 5)
+        # Scroll to trigger lazy loading
+        scroll_for_lazy_load(driver, 2)
 
-    # Chờ đúng nút có id 'codeList'
-    dropdown_btn = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[@id='detailTabs']/div/div/div/ul/li[2]")))
-    time.sleep(5)
-    dropdown_btn.click()
-    time.sleep(5)
+        # Chờ đúng nút có id 'codeList'
+        dropdown_btn = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[@id='detailTabs']/div/div/div/ul/li[2]")))
+        dropdown_btn.click()
+        wait_for_stable_rows(driver, ASIDE_ROW_CLASS, 5)
+    elif not tab_opened:
+        return [], []
     prices=[]
     days_to_ship=[]
     table_price_days_ship=wait.until(EC.presence_of_element_located((By.CLASS_NAME, "PartNumberAsideColumns_table__6fKVE")))
-    rows=table_price_days_ship.find_elements(By.CLASS_NAME, "PartNumberAsideColumns_dataRow__OUw8N")
+    rows=table_price_days_ship.find_elements(By.CLASS_NAME, ASIDE_ROW_CLASS)
     for row in rows:
         #lấy giá
         price_cell=row.find_element(By.CLASS_NAME, "PartNumberAsideColumns_dataCellBase__tIm9A")
@@ -172,69 +1005,13 @@ def get_data_prices_days_ship(driver):
     print("prices:", prices)
     print("days_to_ship:", days_to_ship)
     return prices, days_to_ship
-def get_other_data(driver):
+@profiled("extract_specs")
+def get_other_data(driver, tab_opened=None):
     wait = WebDriverWait(driver, 60)
-    time.sleep(10)  # Tăng thời gian chờ
-    
-    # Scroll để load toàn bộ trang
-    driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-    time.sleep(3)
-    driver.execute_script("window.scrollTo(0, 0);")
-    time.sleep(3)
-    
-    print("Current URL:", driver.current_url)
-    print("Page title:", driver.title)
-    
-    # Thử nhiều cách khác nhau để tìm tab Part Number
-    dropdown_selectors = [
-        "//*[@id='detailTabs']/div/div/div/ul/li[2]",
-        "//li[contains(text(), 'Part Number')]",
-        "//a[contains(text(), 'Part Number')]",
-        "//button[contains(text(), 'Part Number')]",
-        "//div[contains(@class, 'tab') and contains(text(), 'Part Number')]",
-        "//span[contains(text(), 'Part Number')]"
-    ]
-    
-    dropdown_clicked = False
-    for i, selector in enumerate(dropdown_selectors):
-        try:
-            print(f"Trying dropdown selector {i+1}: {selector}")
-            dropdown_btn = wait.until(EC.element_to_be_clickable((By.XPATH, selector)))
-            driver.execute_script("arguments[0].scrollIntoView(true);", dropdown_btn)
-            time.sleep(2)
-            dropdown_btn.click()
-            time.sleep(5)
-            print(f"Successfully clicked dropdown button with selector {i+1}")
-            dropdown_clicked = True
-            break
-        except Exception as e:
-            print(f"Selector {i+1} failed: {e}")
-            continue
-    
-    if not dropdown_clicked:
-        print("All dropdown selectors failed, trying to find any clickable elements...")
-        try:
-            # Tìm tất cả các phần tử có thể click
-            clickable_elements = driver.find_elements(By.XPATH, "//*[contains(@class, 'tab') or contains(@class, 'button') or contains(@class, 'link')]")
-            print(f"Found {len(clickable_elements)} potentially clickable elements")
-            
-            for i, elem in enumerate(clickable_elements[:5]):  # Thử 5 phần tử đầu tiên
-                try:
-                    text = elem.text.strip()
-                    print(f"Element {i+1}: '{text}'")
-                    if 'part' in text.lower() or 'number' in text.lower():
-                        driver.execute_script("arguments[0].scrollIntoView(true);", elem)
-                        time.sleep(1)
-                        elem.click()
-                        time.sleep(5)
-                        print(f"Clicked element with text: '{text}'")
-                        dropdown_clicked = True
-                        break
-                except Exception as e:
-                    print(f"Failed to click element {i+1}: {e}")
-                    continue
-        except Exception as e:
-            print(f"Failed to find clickable elements: {e}")
+    if tab_opened is None:
+        dropdown_clicked = prepare_product_page(driver)
+    else:
+        dropdown_clicked = tab_opened
     
     if not dropdown_clicked:
         print("Could not find or click any dropdown button")
@@ -335,19 +1112,19 @@ def get_other_data(driver):
             EC.presence_of_element_located((By.CLASS_NAME, "PartNumberSpecColumns_tableBase__VK5Nd"))
         )
 
-        rows = table_other_data.find_elements(By.CLASS_NAME, "PartNumberSpecColumns_dataRow__M4B4a")
+        rows = table_other_data.find_elements(By.CLASS_NAME, SPEC_ROW_CLASS)
         print(f"Found {len(rows)} data rows")
         
         # Nếu không tìm thấy rows, thử scroll và đợi thêm
         if len(rows) == 0:
             print("No rows found, trying to scroll and wait...")
             driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(5)
+            wait_for_stable_rows(driver, SPEC_ROW_CLASS, 5)
             driver.execute_script("window.scrollTo(0, 0);")
-            time.sleep(3)
+            wait_for_network_idle(driver, 3)
             
             # Thử tìm lại rows
-            rows = table_other_data.find_elements(By.CLASS_NAME, "PartNumberSpecColumns_dataRow__M4B4a")
+            rows = table_other_data.find_elements(By.CLASS_NAME, SPEC_ROW_CLASS)
             print(f"After scroll: Found {len(rows)} data rows")
 
         for row_idx, row in enumerate(rows):
@@ -393,100 +1170,617 @@ def get_other_data(driver):
     for key, values in table_heade_data.items():
         print(f"  {key}: {len(values)} values")
     return table_heade_data
-def get_url_From_file(file_path,start_index,end_index):
+# ====== PARSE SNAPSHOT HTML (1 LẦN GỌI WEBDRIVER CHO CẢ TRANG) ======
+def make_soup(html):
+    """Dùng lxml nếu có, nếu không thì html.parser"""
     try:
-        df = pd.read_csv(file_path)
-        if 'Product URL' in df.columns:
-            urls = df['Product URL'].tolist()
-            # Add bounds checking
-            if start_index < 0:
-                start_index = 0
-            if end_index > len(urls):
-                end_index = len(urls)
-            if start_index >= end_index:
-                print("⚠ Invalid index range: start_index >= end_index")
-                return []
-            return urls[start_index:end_index]
-        else:
-            print("⚠ 'Product URL' column not found in the CSV file.")
-            print(f"Available columns: {list(df.columns)}")
+        return BeautifulSoup(html, "lxml")
+    except Exception:
+        return BeautifulSoup(html, "html.parser")
+
+def get_page_snapshot(driver):
+    return driver.execute_script("return document.documentElement.outerHTML;")
+
+def _cell_text(element):
+    # Giống WebElement.text: gộp khoảng trắng
+    return " ".join(element.get_text(" ", strip=True).split()) if element else ""
+
+def parse_part_numbers_html(soup, base_url=""):
+    part_numbers = []
+    link_numbers = []
+    for row in soup.select(f"[class*='{PART_NUMBER_ROW_CLASS.split('__')[0]}']"):
+        a = row.find("a")
+        if not a:
+            continue
+        title = a.get("title") or _cell_text(a)
+        link = a.get("href")
+        if title and link:
+            part_numbers.append(title)
+            link_numbers.append(urljoin(base_url, link))
+    return part_numbers, link_numbers
+
+def parse_prices_days_ship_html(soup):
+    prices = []
+    days_to_ship = []
+    for row in soup.select(f"[class*='{ASIDE_ROW_CLASS.split('__')[0]}']"):
+        price_cell = row.select_one("[class*='PartNumberAsideColumns_dataCellBase']")
+        day_to_ship_cell = row.select_one("[class*='PartNumberAsideColumns_daysToShipDataCell']")
+        if not price_cell or not day_to_ship_cell:
+            continue
+        price_data = price_cell.select_one("[class*='PartNumberAsideColumns_data__']")
+        day_to_ship_data = day_to_ship_cell.select_one("[class*='PartNumberAsideColumns_data__']")
+        prices.append(_cell_text(price_data.find("span") if price_data else None))
+        days_to_ship.append(_cell_text(day_to_ship_data.find("span") if day_to_ship_data else None))
+    return prices, days_to_ship
+
+def parse_spec_table_html(soup):
+    table_header = soup.select_one("[class*='PartNumberSpecHeader_tableBase']")
+    if not table_header:
+        return {}
+    table_heade_data = {}
+    for col in table_header.select("[class*='PartNumberSpecHeader_headerCell']"):
+        header_text = col.get_text(" ", strip=True)
+        if header_text:
+            table_heade_data[header_text] = []
+
+    table_other_data = soup.select_one("[class*='PartNumberSpecColumns_tableBase']")
+    if not table_other_data:
+        return table_heade_data
+    header_keys = list(table_heade_data.keys())
+    for row in table_other_data.select(f"[class*='{SPEC_ROW_CLASS.split('__')[0]}']"):
+        values = [div.get_text(strip=True) for div in row.select("div[class*='PartNumberSpecCells_data__']")]
+        for i in range(len(header_keys)):
+            table_heade_data[header_keys[i]].append(values[i] if i < len(values) else '')
+    return table_heade_data
+
+@profiled("parse_snapshot")
+def parse_product_html(html, base_url=""):
+    """Parse cả 3 bảng từ một snapshot HTML"""
+    soup = make_soup(html)
+    part_numbers, link_numbers = parse_part_numbers_html(soup, base_url)
+    prices, days_to_ship = parse_prices_days_ship_html(soup)
+    table_heade_data = parse_spec_table_html(soup)
+    print(f"Snapshot: {len(part_numbers)} part numbers, {len(prices)} prices, "
+          f"{len(table_heade_data)} spec columns")
+    return part_numbers, link_numbers, prices, days_to_ship, table_heade_data
+
+# ====== ĐỌC BẢNG LỚN THEO TỪNG ĐOẠN (BẢNG ẢO HÓA / PHÂN TRANG) ======
+PART_NUMBER_TABLES_CSS = (
+    "[class*='PartNumberColumn_tableBase'], [class*='PartNumberAsideColumns_table'], "
+    "[class*='PartNumberSpecHeader_tableBase'], [class*='PartNumberSpecColumns_tableBase']"
+)
+
+# XPath tương đối: chỉ tìm trong khối chứa bảng Part Number (xem _FIND_NEXT_PAGE_JS)
+PAGINATION_NEXT_SELECTORS = [
+    ".//*[contains(@class, 'Pagination')]//*[contains(@class, 'next') and not(@disabled)]",
+    ".//button[@aria-label='Next' and not(@disabled)]",
+    ".//a[@rel='next']",
+]
+
+# Đi ngược từ bảng Part Number lên, khối cha gần nhất có nút "next" là phân trang của bảng;
+# không lên tới body để không bấm nhầm phân trang review / sản phẩm liên quan của trang
+_FIND_NEXT_PAGE_JS = """
+    const selectors = arguments[0];
+    let el = document.querySelector("[class*='PartNumberColumn_tableBase']");
+    while (el && el !== document.body) {
+        for (const selector of selectors) {
+            const found = document.evaluate(
+                selector, el, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+            if (found) return found;
+        }
+        el = el.parentElement;
+    }
+    return null;
+"""
+
+# Tìm phần tử cha cuộn được (overflow auto/scroll) của bảng Part Number
+_FIND_TABLE_SCROLLER_JS = """
+    let el = document.querySelector("[class*='PartNumberColumn_tableBase']");
+    while (el && el !== document.body) {
+        const style = getComputedStyle(el);
+        if (/(auto|scroll)/.test(style.overflowY) && el.scrollHeight > el.clientHeight + 1) return el;
+        el = el.parentElement;
+    }
+    return null;
+"""
+
+def get_tables_html(driver):
+    """outerHTML của riêng 4 bảng Part Number (nhỏ hơn nhiều so với cả trang)"""
+    return driver.execute_script(
+        "return Array.from(document.querySelectorAll(arguments[0])).map(el => el.outerHTML).join('');",
+        PART_NUMBER_TABLES_CSS,
+    ) or ""
+
+def _find_next_page_button(driver):
+    return driver.execute_script(_FIND_NEXT_PAGE_JS, PAGINATION_NEXT_SELECTORS)
+
+def table_has_more_rows(driver):
+    """True nếu bảng Part Number còn rows chưa render (cuộn được) hoặc có trang tiếp theo"""
+    try:
+        scrollable = driver.execute_script(
+            f"const el = (function() {{ {_FIND_TABLE_SCROLLER_JS} }})();"
+            "return !!el && el.scrollTop + el.clientHeight < el.scrollHeight - 1;"
+        )
+        return bool(scrollable) or _find_next_page_button(driver) is not None
+    except Exception:
+        return False
+
+def _advance_table(driver):
+    """Cuộn bảng xuống một đoạn, hết thì bấm trang tiếp theo; trả về False nếu đã tới cuối"""
+    scrolled = driver.execute_script(
+        f"const el = (function() {{ {_FIND_TABLE_SCROLLER_JS} }})();"
+        "if (!el) return false;"
+        "const before = el.scrollTop;"
+        "el.scrollTop = before + el.clientHeight * 0.8;"
+        "return el.scrollTop > before;"
+    )
+    if not scrolled:
+        button = _find_next_page_button(driver)
+        if button is None:
+            return False
+        path_before = driver.execute_script("return location.pathname;")
+        driver.execute_script("arguments[0].click();", button)
+        wait_for_stable_rows(driver, PART_NUMBER_ROW_CLASS, 3, stable_time=0.5)
+        # Nút "next" đưa sang trang khác thay vì lật bảng: dừng, không gom row của trang lạ
+        path_after = driver.execute_script("return location.pathname;")
+        if path_after != path_before:
+            print(f"⚠ Next button left the product page ({path_before} -> {path_after}), stop streaming")
+            return False
+        return True
+    wait_for_stable_rows(driver, PART_NUMBER_ROW_CLASS, 3, stable_time=0.5)
+    return True
+
+def iter_part_number_rows(driver, max_steps=None):
+    """Generator: đọc bảng Part Number từng đoạn, yield mỗi row (dict) một lần theo Part Number
+
+    Mỗi bước chỉ parse HTML của 4 bảng đang render nên bộ nhớ không tăng theo kích thước bảng.
+    Link chi tiết của part nằm ở khóa '_link'.
+    """
+    max_steps = max_steps or STREAM_MAX_STEPS
+    seen = set()
+    idle_steps = 0
+    for step in range(max_steps):
+        soup = make_soup(get_tables_html(driver))
+        part_numbers, link_numbers = parse_part_numbers_html(soup, driver.current_url)
+        prices, days_to_ship = parse_prices_days_ship_html(soup)
+        table_heade_data = parse_spec_table_html(soup)
+        new_rows = 0
+        for i, part_number in enumerate(part_numbers):
+            if part_number in seen:
+                continue
+            seen.add(part_number)
+            new_rows += 1
+            row = {
+                'Part Number': part_number,
+                'Price': prices[i] if i < len(prices) else '',
+                'Days to Ship': days_to_ship[i] if i < len(days_to_ship) else '',
+            }
+            for header, values in table_heade_data.items():
+                row[header] = values[i] if i < len(values) else ''
+            row['_link'] = link_numbers[i]
+            yield row
+        # Vài bước liền không có row mới thì coi như đã hết bảng
+        idle_steps = 0 if new_rows else idle_steps + 1
+        if idle_steps >= 3 or not _advance_table(driver):
+            break
+    print(f"Streamed {len(seen)} unique part number rows")
+
+def collect_streamed_rows(driver):
+    """Gom các row từ iter_part_number_rows thành các cột như parse_product_html trả về"""
+    part_numbers, link_numbers, prices, days_to_ship = [], [], [], []
+    table_heade_data = {}
+    for row_index, row in enumerate(iter_part_number_rows(driver)):
+        part_numbers.append(row.pop('Part Number'))
+        link_numbers.append(row.pop('_link'))
+        prices.append(row.pop('Price'))
+        days_to_ship.append(row.pop('Days to Ship'))
+        for header, value in row.items():
+            # Header mới xuất hiện giữa chừng: điền '' cho các row trước
+            table_heade_data.setdefault(header, [''] * row_index).append(value)
+        for header, values in table_heade_data.items():
+            if len(values) < row_index + 1:
+                values.append('')
+    if not any(prices):
+        prices, days_to_ship = [], []
+    return part_numbers, link_numbers, prices, days_to_ship, table_heade_data
+
+# ====== ĐỌC DANH SÁCH URL (STREAMING, DEDUPE, CHIA SHARD) ======
+def normalize_product_url(url):
+    """Bỏ tracking params (KWSearch, searchFlow, utm_*...) và fragment, sắp xếp query còn lại"""
+    parsed = urlparse(url.strip())
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if key not in TRACKING_QUERY_PARAMS and not key.startswith("utm_")
+    )
+    return urlunparse((parsed.scheme.lower(), parsed.netloc.lower(), parsed.path, parsed.params, urlencode(query), ""))
+
+def shard_of(url, num_shards):
+    """Shard cố định theo hash URL: mọi máy chia giống nhau, không phụ thuộc thứ tự input"""
+    return int(hashlib.sha1(url.encode("utf-8")).hexdigest()[:8], 16) % num_shards
+
+def iter_urls_from_file(file_path, url_column=None):
+    """Đọc URL lười từng dòng từ CSV (cột url_column) hoặc JSONL (chuỗi hoặc object)"""
+    url_column = url_column or URL_COLUMN
+    if file_path.lower().endswith((".jsonl", ".ndjson")):
+        with open(file_path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                url = record if isinstance(record, str) else record.get(url_column) or record.get("url")
+                if url:
+                    yield url
+        return
+    with open(file_path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        if url_column not in (reader.fieldnames or []):
+            print(f"⚠ '{url_column}' column not found in the CSV file.")
+            print(f"Available columns: {reader.fieldnames}")
+            return
+        for row in reader:
+            if row.get(url_column):
+                yield row[url_column]
+
+def iter_urls(file_path, start_index=0, end_index=None, shard_index=0, num_shards=1, normalize=True, dedupe=True):
+    """URL theo thứ tự file, đã chuẩn hóa và bỏ trùng; start/end_index tính trên các URL không trùng"""
+    seen = set()
+    position = 0
+    for raw_url in iter_urls_from_file(file_path):
+        url = normalize_product_url(raw_url) if normalize else raw_url.strip()
+        if dedupe:
+            # Lưu digest 8 byte thay vì cả chuỗi URL để set nhỏ với input rất lớn
+            digest = hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest()
+            if digest in seen:
+                continue
+            seen.add(digest)
+        index = position
+        position += 1
+        if index < start_index:
+            continue
+        if end_index is not None and index >= end_index:
+            break
+        if num_shards > 1 and shard_of(url, num_shards) != shard_index:
+            continue
+        yield url
+
+def get_url_From_file(file_path,start_index,end_index, shard_index=0, num_shards=1):
+    try:
+        # Add bounds checking
+        if start_index < 0:
+            start_index = 0
+        if end_index is not None and start_index >= end_index:
+            print("⚠ Invalid index range: start_index >= end_index")
             return []
+        return list(iter_urls(file_path, start_index, end_index, shard_index, num_shards))
     except FileNotFoundError:
         print(f"⚠ File not found: {file_path}")
         return []
     except Exception as e:
         print(f"⚠ Error reading file {file_path}: {e}")
         return []
+def combine_extracted_data(part_numbers, prices, days_to_ship, table_heade_data, link_numbers=None):
+    # Kết hợp tất cả dữ liệu
+    combined_data = {}
+    
+    # Thêm Part Numbers
+    if part_numbers:
+        combined_data['Part Number'] = part_numbers
+        print(f"Added {len(part_numbers)} Part Numbers")
+    
+    # Link chi tiết từng part: chỉ giữ khi bật fan-out
+    if FOLLOW_PART_LINKS and link_numbers and any(link_numbers):
+        combined_data['Part Link'] = link_numbers
+    
+    # Thêm Prices
+    if prices:
+        combined_data['Price'] = prices
+        print(f"Added {len(prices)} Prices")
+    
+    # Thêm Days to Ship
+    if days_to_ship:
+        combined_data['Days to Ship'] = days_to_ship
+        print(f"Added {len(days_to_ship)} Days to Ship")
+    
+    # Thêm Specifications
+    if table_heade_data:
+        combined_data.update(table_heade_data)
+        print(f"Added {len(table_heade_data)} specification columns")
+    
+    # Add debugging information
+    if combined_data:
+        print(f"Successfully extracted combined data with {len(combined_data)} columns")
+        for key, values in combined_data.items():
+            print(f"  {key}: {len(values)} values")
+    else:
+        print("No data extracted from this URL")
+    return combined_data
+
+# ====== PAGE CACHE (BỎ QUA TRANG KHÔNG ĐỔI) ======
+class PageCache:
+    """Cache trên đĩa: mỗi URL một file JSON (data đã trích xuất + hash HTML các bảng)
+
+    Hết TTL thì coi là cũ; vượt max_bytes thì xóa các file ít dùng nhất.
+    """
+
+    def __init__(self, directory, ttl=None, max_bytes=None):
+        self.directory = directory
+        self.ttl = PAGE_CACHE_TTL if ttl is None else ttl
+        self.max_bytes = PAGE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.name.endswith(".json"))
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, url):
+        path = self._path(url)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)  # đánh dấu vừa dùng cho LRU
+            return entry
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, entry):
+        return entry is not None and time.time() - entry.get("time", 0) < self.ttl
+
+    def get_fresh(self, url):
+        entry = self.get(url)
+        return entry["data"] if self.is_fresh(entry) else None
+
+    def put(self, url, url_data, content_hash=None):
+        path = self._path(url)
+        payload = json.dumps({"url": url, "time": time.time(), "hash": content_hash, "data": url_data},
+                             ensure_ascii=False)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+        with self._lock:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            self._size += os.path.getsize(path) - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted((entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")),
+                         key=lambda entry: entry.stat().st_mtime)
+        # Xóa về 90% giới hạn để không phải evict sau mỗi lần put
+        target = self.max_bytes * 0.9
+        for entry in entries:
+            if self._size <= target:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+                self._size -= size
+            except OSError:
+                continue
+
+_page_cache = None
+
+def get_page_cache():
+    """PageCache dùng chung theo PAGE_CACHE_DIR (None nếu tắt cache)"""
+    global _page_cache
+    if not PAGE_CACHE_DIR:
+        return None
+    if _page_cache is None or _page_cache.directory != PAGE_CACHE_DIR:
+        _page_cache = PageCache(PAGE_CACHE_DIR)
+    return _page_cache
+
+def tables_content_hash(driver):
+    """Hash HTML của 4 bảng Part Number đang render (một lần gọi WebDriver)"""
+    return hashlib.sha256(get_tables_html(driver).encode("utf-8")).hexdigest()
+
 def get_data_from_url(driver, url):
+    cache = get_page_cache()
+    if cache and PAGE_CACHE_REFRESH == "ttl":
+        cached_data = cache.get_fresh(url)
+        if cached_data:
+            print(f"Using cached data for {url}")
+            return cached_data
     try:
-        driver.get(url)
-        time.sleep(5)
+        with PROFILER.stage("navigation"):
+            driver.get(url)
+        # Trang lỗi / captcha / không phải sản phẩm: dừng ngay thay vì chờ hết timeout của các extractor
+        if not check_page(driver):
+            return {}
+        wait_for_network_idle(driver, 5)
         
         # Check if page loaded successfully
         if "misumi-ec.com" not in driver.current_url:
             print(f"Page redirect detected. Current URL: {driver.current_url}")
         
-        # Lấy Part Numbers trước
-        print("=== Lấy Part Numbers ===")
-        part_numbers, link_numbers = extract_all_part_numbers(driver)
+        # Chuẩn bị trang một lần (scroll + click tab Part Number) cho cả 3 bảng
+        print("=== Mở tab Part Number ===")
+        tab_opened = prepare_product_page(driver)
+        if not tab_opened:
+            print("Could not open Part Number tab, skipping extractors")
+            return {}
         
-        # Lấy Prices và Days to Ship
-        print("=== Lấy Prices và Days to Ship ===")
-        prices, days_to_ship = get_data_prices_days_ship(driver)
+        content_hash = None
+        if cache:
+            content_hash = tables_content_hash(driver)
+            entry = cache.get(url)
+            if entry and entry.get("hash") == content_hash and entry.get("data"):
+                print("Tables unchanged since last run, using cached data")
+                cache.put(url, entry["data"], content_hash)
+                return entry["data"]
         
-        # Lấy Specifications
-        print("=== Lấy Specifications ===")
-        table_heade_data = get_other_data(driver)
-        
-        # Kết hợp tất cả dữ liệu
-        combined_data = {}
+        part_numbers, link_numbers, prices, days_to_ship, table_heade_data = [], [], [], [], {}
+        if EXTRACTION_MODE == "snapshot":
+            print("=== Parse snapshot HTML ===")
+            with PROFILER.stage("snapshot"):
+                html = get_page_snapshot(driver)
+            if FIXTURE_RECORD_DIR:
+                save_page_fixture(FIXTURE_RECORD_DIR, url, html)
+            part_numbers, link_numbers, prices, days_to_ship, table_heade_data = parse_product_html(
+                html, driver.current_url
+            )
         
-        # Thêm Part Numbers
-        if part_numbers:
-            combined_data['Part Number'] = part_numbers
-            print(f"Added {len(part_numbers)} Part Numbers")
+        # Bảng nào snapshot không đọc được thì lấy lại bằng WebDriver
+        # Lấy Part Numbers trước
+        if not part_numbers:
+            print("=== Lấy Part Numbers ===")
+            part_numbers, link_numbers = extract_all_part_numbers(driver, tab_opened)
         
-        # Thêm Prices
-        if prices:
-            combined_data['Price'] = prices
-            print(f"Added {len(prices)} Prices")
+        # Lấy Prices và Days to Ship
+        if not prices:
+            print("=== Lấy Prices và Days to Ship ===")
+            prices, days_to_ship = get_data_prices_days_ship(driver, tab_opened)
         
-        # Thêm Days to Ship
-        if days_to_ship:
-            combined_data['Days to Ship'] = days_to_ship
-            print(f"Added {len(days_to_ship)} Days to Ship")
+        # Lấy Specifications
+        if not table_heade_data:
+            print("=== Lấy Specifications ===")
+            table_heade_data = get_other_data(driver, tab_opened)
         
-        # Thêm Specifications
-        if table_heade_data:
-            combined_data.update(table_heade_data)
-            print(f"Added {len(table_heade_data)} specification columns")
+        # Bảng ảo hóa / phân trang chỉ có một phần rows trong DOM: đọc hết bảng theo từng đoạn
+        if STREAM_LARGE_TABLES and part_numbers and table_has_more_rows(driver):
+            print("=== Part Number table has more rows, streaming ===")
+            with PROFILER.stage("stream_rows"):
+                part_numbers, link_numbers, prices, days_to_ship, table_heade_data = collect_streamed_rows(driver)
         
-        # Add debugging information
-        if combined_data:
-            print(f"Successfully extracted combined data with {len(combined_data)} columns")
-            for key, values in combined_data.items():
-                print(f"  {key}: {len(values)} values")
-        else:
-            print("No data extracted from this URL")
-            
+        combined_data = combine_extracted_data(part_numbers, prices, days_to_ship, table_heade_data, link_numbers)
+        if cache and combined_data:
+            cache.put(url, combined_data, content_hash)
         return combined_data
         
+    except SkipPage:
+        raise
     except Exception as e:
         print(f"Error in get_data_from_url: {e}")
         return {}
 
+# ====== HTTP FETCH (KHÔNG CẦN BROWSER) ======
+_http_pool = None
+_http_pool_lock = threading.Lock()
+
+def get_http_pool():
+    """PoolManager dùng chung cho mọi worker (giữ connection keep-alive)"""
+    global _http_pool
+    with _http_pool_lock:
+        if _http_pool is None:
+            _http_pool = urllib3.PoolManager(
+                num_pools=4,
+                maxsize=HTTP_POOL_SIZE,
+                block=True,
+                headers={"User-Agent": USER_AGENT, "Accept-Language": "en-US,en;q=0.9"},
+                retries=urllib3.Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504]),
+                timeout=urllib3.Timeout(total=HTTP_TIMEOUT),
+            )
+    return _http_pool
+
+def fetch_html(url):
+    try:
+        response = get_http_pool().request("GET", url)
+    except Exception as e:
+        print(f"HTTP fetch failed for {url}: {e}")
+        return None
+    if response.status != 200:
+        print(f"HTTP {response.status} for {url}")
+        return None
+    return response.data.decode("utf-8", errors="replace")
+
+def extract_embedded_state(html):
+    """Lấy JSON state mà Next.js nhúng trong trang (script#__NEXT_DATA__)"""
+    script = make_soup(html).find("script", id="__NEXT_DATA__")
+    if not script or not script.string:
+        return None
+    try:
+        return json.loads(script.string)
+    except ValueError:
+        return None
+
+def find_part_number_records(state):
+    """Tìm list dict đầu tiên có khóa partNumber trong JSON state"""
+    stack = [state]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            if node and isinstance(node[0], dict) and "partNumber" in node[0]:
+                return node
+            stack.extend(reversed(node))
+        elif isinstance(node, dict):
+            stack.extend(reversed(list(node.values())))
+    return []
+
+def _first_value(record, keys):
+    for key in keys:
+        value = record.get(key)
+        if value not in (None, ""):
+            return str(value)
+    return ""
+
+def parse_embedded_state(state, base_url=""):
+    part_numbers, link_numbers, prices, days_to_ship = [], [], [], []
+    for record in find_part_number_records(state):
+        part_numbers.append(str(record.get("partNumber")))
+        link_numbers.append(urljoin(base_url, _first_value(record, ["detailUrl", "url", "href"])))
+        prices.append(_first_value(record, ["standardUnitPrice", "unitPrice", "price"]))
+        days_to_ship.append(_first_value(record, ["daysToShip", "shipDays"]))
+    if not any(prices):
+        prices, days_to_ship = [], []
+    return part_numbers, link_numbers, prices, days_to_ship
+
+@profiled("http_fetch")
+def get_data_from_url_http(url):
+    """Lấy dữ liệu chỉ bằng HTTP: bảng render sẵn trong HTML, sau đó JSON state nhúng"""
+    html = fetch_html(url)
+    if not html:
+        return {}
+    part_numbers, link_numbers, prices, days_to_ship, table_heade_data = parse_product_html(html, url)
+    if not part_numbers or not prices:
+        state = extract_embedded_state(html)
+        if state:
+            part_numbers, link_numbers, prices, days_to_ship = parse_embedded_state(state, url)
+            print(f"Embedded state: {len(part_numbers)} part numbers, {len(prices)} prices")
+    # Thiếu part number hoặc giá thì để Chrome lấy lại cả trang
+    if not part_numbers or not prices:
+        return {}
+    return combine_extracted_data(part_numbers, prices, days_to_ship, table_heade_data, link_numbers)
+
+# ====== FIXTURE SERVER (REPLAY TRANG ĐÃ LƯU, CHẠY OFFLINE) ======
+def fixture_path_for_url(fixture_dir, url):
+    return os.path.join(fixture_dir, urlparse(url).path.strip("/"), "index.html")
+
+def save_page_fixture(fixture_dir, url, html):
+    path = fixture_path_for_url(fixture_dir, url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html)
+    return path
+
+def to_fixture_url(url, base_url):
+    """Đổi host của URL thật sang fixture server, giữ nguyên path và query"""
+    parsed = urlparse(url)
+    return base_url.rstrip("/") + parsed.path + (f"?{parsed.query}" if parsed.query else "")
+
+class _FixtureRequestHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def start_fixture_server(fixture_dir, port=0):
+    """Chạy HTTP server trả về các trang đã lưu trong fixture_dir; trả về (server, base_url)"""
+    handler = lambda *args, **kwargs: _FixtureRequestHandler(*args, directory=fixture_dir, **kwargs)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, name="fixture-server", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
 def validate_data_consistency(all_combined_data):
-    """Kiểm tra tính nhất quán của dữ liệu"""
-    if not all_combined_data:
+    """Kiểm tra tính nhất quán của dữ liệu (dict các list hoặc DataFrame)"""
+    if all_combined_data is None or len(all_combined_data.keys()) == 0:
         return False
     
     # Kiểm tra tất cả các cột có cùng độ dài
-    lengths = [len(values) for values in all_combined_data.values()]
+    lengths = [len(values) for _, values in all_combined_data.items()]
     if len(set(lengths)) != 1:
         print(f"⚠ Lỗi: Các cột có độ dài khác nhau: {lengths}")
         return False
     
-    print(f"✅ Tất cả {len(all_combined_data)} cột đều có {lengths[0]} rows")
+    print(f"✅ Tất cả {len(all_combined_data.keys())} cột đều có {lengths[0]} rows")
     return True
 
 def print_data_processing_info(url, url_data, all_combined_data, total_rows_processed, url_row_count):
@@ -509,130 +1803,1074 @@ def print_data_processing_info(url, url_data, all_combined_data, total_rows_proc
     
     print("=" * 50)
 
-# ====== MAIN ======
-def main():
-    #2 dòng cần chú ý
-    urls = get_url_From_file(r"C:\Users\abc\Pictures\code\Chay-Code\ooo\same_day_products_from_html.csv",0,181)
-    name_file_to_save=r"C:\Users\abc\Pictures\code\Chay-Code\ooo\input_Name_here_with_part_number0_180"
-    #2 dòng cần chú ý
-    # url1="https://vn.misumi-ec.com/vona2/detail/110300107740/?KWSearch=bearing&searchFlow=results2products&list=PageSearchResult"
-    # Initialize data structure to accumulate all data
-    all_combined_data = {}
-    total_rows_processed = 0
+def scrape_url(driver, url):
+    """Lấy dữ liệu một URL bằng driver đã mượn (một lần thử, việc retry do scheduler lo)"""
+    url_data = get_data_from_url(driver, url)
     
-    for url in urls:
-        # url=url1
-        print("Processing URL:", url)
-        driver = setup_driver()
-        if not driver:
-            print("Failed to setup Chrome driver")
-            continue
-            
-        try:
-            driver.maximize_window()
-            url_data = get_data_from_url(driver, url)
-            
-            # Check if we got any data from this URL
-            if not url_data:
-                print(f"No data structure extracted from URL: {url}")
-                continue
-                
-            # Get the number of rows from this URL
-            url_row_count = max(len(values) for values in url_data.values()) if url_data else 0
-            
-            if url_row_count == 0:
-                print(f"⚠ Warning: Found {len(url_data)} columns but 0 data rows from URL: {url}")
-                print("This might indicate the page structure is different or data is loaded dynamically")
-                # Thử thêm một lần nữa với delay dài hơn
-                time.sleep(10)
-                print("Retrying data extraction with longer delay...")
-                url_data = get_other_data(driver)
+    # Check if we got any data from this URL
+    if not url_data:
+        print(f"No data structure extracted from URL: {url}")
+        return {}, 0
+        
+    # Get the number of rows from this URL
+    url_row_count = max(len(values) for values in url_data.values()) if url_data else 0
+    
+    if url_row_count == 0:
+        print(f"⚠ Warning: Found {len(url_data)} columns but 0 data rows from URL: {url}")
+        print("This might indicate the page structure is different or data is loaded dynamically")
+    return url_data, url_row_count
+
+# ====== GỘP DỮ LIỆU THEO CỘT ======
+class ColumnarAccumulator:
+    """Gộp dữ liệu các URL thành một list giá trị cho mỗi cột, tạo DataFrame một lần ở cuối
+
+    Cột mới chỉ ghi lại row bắt đầu thay vì pad [''] * total_rows_processed ngay; phần thiếu
+    ở giữa được điền khi cột có dữ liệu lại, phần đầu / cuối điền khi tạo DataFrame.
+    """
+
+    def __init__(self):
+        self.columns = {'Source_URL': []}     # tên cột -> list giá trị (dict giữ thứ tự xuất hiện)
+        self.starts = {'Source_URL': 0}       # tên cột -> row đầu tiên của list
+        self.total_rows = 0
+        self._header_names = {}               # canonical_header -> tên cột gặp đầu tiên
+        self._key_names = {}                  # header gốc -> tên cột, khỏi chuẩn hóa lại mỗi URL
+
+    def column_name(self, key):
+        """Header chỉ khác khoảng trắng / dạng Unicode giữa các URL dùng chung một cột"""
+        name = self._key_names.get(key)
+        if name is None:
+            name = self._key_names[key] = self._header_names.setdefault(canonical_header(key), key)
+        return name
+
+    def _column(self, name):
+        """List của cột name, đã điền '' tới row hiện tại"""
+        if name not in self.columns:
+            self.columns[name] = []
+            self.starts[name] = self.total_rows
+        values = self.columns[name]
+        missing = self.total_rows - self.starts[name] - len(values)
+        if missing:
+            values.extend([''] * missing)
+        return values
+
+    def add(self, url, url_data, url_row_count):
+        self._column('Source_URL').extend([url] * url_row_count)
+        used = {'Source_URL'}
+        for key, values in url_data.items():
+            name = self.column_name(key)
+            # Cột đã có dữ liệu của một header khác cùng trang: không ghi đè, dùng tên gốc (thêm số nếu vẫn trùng)
+            if name in used:
+                name = key
+                suffix = 2
+                while name in used:
+                    name = f"{key} ({suffix})"
+                    suffix += 1
+            used.add(name)
+            column = self._column(name)
+            column.extend(values)
+            # Cột ngắn hơn được điền '' cho đủ url_row_count rows
+            if len(values) < url_row_count:
+                column.extend([''] * (url_row_count - len(values)))
+        self.total_rows += url_row_count
+
+    def to_frame(self):
+        if not self.total_rows:
+            return pd.DataFrame()
+        data = {}
+        for name, values in self.columns.items():
+            start = self.starts[name]
+            data[name] = [''] * start + values + [''] * (self.total_rows - start - len(values))
+        return pd.DataFrame(data)
+
+def canonical_header(name):
+    """"Bore Dia. d (mm)" và "Bore Dia.  d(mm)" -> cùng một key
+
+    Chỉ bỏ khác biệt về khoảng trắng và dạng Unicode; giữ nguyên hoa thường (cột d và D là 2 kích thước khác nhau).
+    """
+    text = re.sub(r"\s+", " ", unicodedata.normalize("NFKC", str(name))).strip()
+    return re.sub(r"\s*([()\[\]/:,])\s*", r"\1", text)
+
+# ====== KIỂU DỮ LIỆU CỘT (SỐ + CATEGORY) ======
+PRICE_NUMBER_PATTERN = r'(\d[\d,]*(?:\.\d+)?)'
+PRICE_CURRENCY_PATTERN = r'([A-Z]{3}|₫|\$|¥|€)'
+SAME_DAY_PATTERN = r'(?i)same\s*day|trong\s*ngày|当日'
+# Gần như mỗi row một giá trị, chuyển sang category chỉ tốn thêm bộ nhớ
+TEXT_COLUMNS = ['Part Number']
+# Cột không phải spec của sản phẩm
+BASE_COLUMNS = ['Source_URL', 'Part Number', 'Price', 'Days to Ship', 'Part Link', 'Parent URL']
+SPEC_VALUE_PATTERN = r'^\s*([-+]?\d+(?:\.\d+)?)\s*([^\d\s]{1,8})?\s*$'
+
+def parse_price_column(prices):
+    """"1,234,000 VND" -> (1234000.0, "VND"); ô không có số (Quote, '') -> NaN"""
+    text = prices.astype(str)
+    values = pd.to_numeric(text.str.extract(PRICE_NUMBER_PATTERN, expand=False).str.replace(',', '', regex=False),
+                           errors='coerce')
+    currency = text.str.extract(PRICE_CURRENCY_PATTERN, expand=False).astype('category')
+    return values.astype('float64'), currency
+
+def parse_days_to_ship_column(days_to_ship):
+    """"Same day" -> 0, "4 Days" -> 4, còn lại (Quote, '') -> NaN"""
+    text = days_to_ship.astype(str)
+    days = pd.to_numeric(text.str.extract(r'(\d+)', expand=False), errors='coerce')
+    days = days.mask(text.str.contains(SAME_DAY_PATTERN, regex=True), 0)
+    return days.astype('float32')
+
+def to_typed_frame(df, category_max_ratio=None):
+    """Thêm cột số cho Price / Days to Ship và chuyển các cột text lặp lại (Source_URL, spec...) sang category"""
+    category_max_ratio = CATEGORY_MAX_RATIO if category_max_ratio is None else category_max_ratio
+    if df.empty:
+        return df
+    typed = {}
+    for col in df.columns:
+        typed[col] = df[col]
+        if col not in TEXT_COLUMNS and pd.api.types.is_string_dtype(df[col]):
+            if df[col].nunique(dropna=False) <= len(df) * category_max_ratio:
+                typed[col] = df[col].astype('category')
+        if col == 'Price':
+            typed['Price Value'], typed['Price Currency'] = parse_price_column(df[col])
+        elif col == 'Days to Ship':
+            typed['Days to Ship Value'] = parse_days_to_ship_column(df[col])
+    return pd.DataFrame(typed, index=df.index)
+
+def _uniform_unit_values(column):
+    """(Series số, đơn vị) nếu mọi ô có dữ liệu là số cùng đơn vị, ngược lại None"""
+    text = column.fillna('').str.strip()
+    filled = text != ''
+    if not filled.any() or text[filled].str.match(r'[-+]?0\d').any():
+        return None
+    parts = text[filled].str.extract(SPEC_VALUE_PATTERN)
+    units = parts[1].fillna('').unique()
+    if parts[0].isna().any() or len(units) != 1:
+        return None
+    return pd.to_numeric(parts[0]).reindex(column.index), units[0]
+
+def normalize_spec_columns(df):
+    """Đổi cột spec dạng "10mm" / "12 mm" thành một cột số, đơn vị đưa lên header: "<cột> [mm]"
+
+    Chỉ đổi khi mọi ô có dữ liệu đều là số với cùng một đơn vị (hoặc cùng không có đơn vị)
+    và không có số bắt đầu bằng 0 như mã vật liệu; các cột khác giữ nguyên.
+    """
+    normalized = {}
+    for col in df.columns:
+        numeric = None
+        if col not in BASE_COLUMNS and pd.api.types.is_string_dtype(df[col]):
+            numeric = _uniform_unit_values(df[col])
+        if numeric is None:
+            normalized[col] = df[col]
+        else:
+            values, unit = numeric
+            normalized[f"{col} [{unit}]" if unit else col] = values
+    return pd.DataFrame(normalized, index=df.index)
+
+def fill_stats(df):
+    """Số ô có dữ liệu (không NaN, không '') của mỗi cột, tính một lần cho cả frame"""
+    return (df.notna() & df.ne('')).sum()
+
+# ====== ASYNC CRAWL ENGINE ======
+class TokenBucket:
+    """Giới hạn tốc độ request: rate token/giây, tối đa capacity token"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            await asyncio.sleep(delay)
+
+class HostRateLimiter:
+    """Mỗi host một TokenBucket riêng"""
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = RATE_LIMIT_PER_HOST if rate is None else rate
+        self.burst = RATE_LIMIT_BURST if burst is None else burst
+        self._buckets = {}
+
+    async def acquire(self, url):
+        host = urlparse(url).netloc
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self.rate, self.burst)
+        await self._buckets[host].acquire()
+
+def backoff_delay(attempt, base=None, cap=None):
+    """Exponential backoff có jitter để các worker không retry cùng lúc"""
+    base = RETRY_BASE_DELAY if base is None else base
+    cap = RETRY_MAX_DELAY if cap is None else cap
+    return min(cap, base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+def make_url_fetcher(pool):
+    """Hàm lấy dữ liệu một URL (chạy trong thread): HTTP trước nếu bật, sau đó Chrome"""
+    def fetch(url):
+        with PROFILER.url(url):
+            cache = get_page_cache()
+            if cache and PAGE_CACHE_REFRESH == "ttl":
+                # Dữ liệu còn hạn: không cần mượn Chrome
+                url_data = cache.get_fresh(url)
+                if url_data:
+                    print(f"Using cached data for {url}")
+                    return url_data, max(len(values) for values in url_data.values())
+            if FETCH_MODE == "http":
+                url_data = get_data_from_url_http(url)
                 url_row_count = max(len(values) for values in url_data.values()) if url_data else 0
-                
-                if url_row_count == 0:
-                    print(f"Still no data after retry, skipping URL: {url}")
+                if url_row_count:
+                    if cache:
+                        cache.put(url, url_data)
+                    return url_data, url_row_count
+                print("HTTP fetch got no rows, falling back to Chrome")
+            with pool.driver() as driver:
+                if not driver:
+                    raise RuntimeError("Failed to setup Chrome driver")
+                return scrape_url(driver, url)
+    return fetch
+
+async def crawl_urls_async(urls, fetch, max_in_flight=NUM_WORKERS, rate_limiter=None, max_retries=None, on_result=None,
+                           keep_results=True):
+    """Chạy fetch(url) với tối đa max_in_flight URL cùng lúc, rate limit theo host và retry có backoff
+
+    on_result(url, url_data, url_row_count) được gọi ngay khi một URL xong (kể cả khi bỏ qua).
+    keep_results=False: không giữ dữ liệu trong RAM (on_result đã ghi ra checkpoint), chỉ trả về số rows.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_in_flight))
+    rate_limiter = rate_limiter or HostRateLimiter()
+    max_retries = MAX_RETRIES if max_retries is None else max_retries
+    results = [None] * len(urls)
+
+    async def run(index, url):
+        for attempt in range(max_retries + 1):
+            async with semaphore:
+                # Lấy token khi đã có chỗ chạy, ngay trước fetch: URL đang xếp hàng không giữ sẵn token
+                await rate_limiter.acquire(url)
+                print("Processing URL:", url)
+                try:
+                    url_data, url_row_count = await asyncio.to_thread(fetch, url)
+                except SkipPage as e:
+                    print(f"Skipping URL {url}: {e}")
+                    break
+                except Exception as e:
+                    print(f"Error processing URL {url}: {e}")
+                    url_data, url_row_count = {}, 0
+            if url_row_count:
+                results[index] = (url_data if keep_results else None, url_row_count)
+                if on_result:
+                    on_result(url, url_data, url_row_count)
+                return
+            if attempt < max_retries:
+                delay = backoff_delay(attempt)
+                print(f"Retrying {url} in {delay:.1f}s (attempt {attempt + 2}/{max_retries + 1})")
+                await asyncio.sleep(delay)
+        else:
+            print(f"Still no data after {max_retries + 1} attempts, skipping URL: {url}")
+        if on_result:
+            on_result(url, {}, 0)
+
+    await asyncio.gather(*(run(index, url) for index, url in enumerate(urls)))
+    return results
+
+# ====== CHECKPOINT (GHI KẾT QUẢ TỪNG URL, CHẠY TIẾP SAU KHI CRASH) ======
+class RunCheckpoint:
+    """File JSONL append-only, mỗi dòng là kết quả của một URL"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Dòng cuối có thể bị cắt dở nếu process bị kill
                     continue
-                else:
-                    print(f"✅ Successfully extracted {url_row_count} rows after retry")
-                
-            print(f"Extracted {url_row_count} rows from URL")
-            
-            # In thông tin chi tiết về quá trình xử lý
-            print_data_processing_info(url, url_data, all_combined_data, total_rows_processed, url_row_count)
-            
-            # Add URL identifier to track data source
-            if 'Source_URL' not in all_combined_data:
-                all_combined_data['Source_URL'] = []
-            all_combined_data['Source_URL'].extend([url] * url_row_count)
-            
-            # Xử lý các cột mới từ URL hiện tại
-            new_columns = []
-            for key in url_data.keys():
-                if key not in all_combined_data:
-                    new_columns.append(key)
-                    print(f"Adding new column: {key}")
-                    all_combined_data[key] = []
-                    # Điền giá trị rỗng cho tất cả dữ liệu cũ (từ các URL trước đó)
-                    all_combined_data[key].extend([''] * total_rows_processed)
-            
-            # Xử lý các cột hiện có trong all_combined_data nhưng không có trong url_data
-            missing_columns = []
-            for key in all_combined_data.keys():
-                if key not in url_data and key != 'Source_URL':
-                    missing_columns.append(key)
-                    print(f"Column '{key}' missing in current URL, will fill with empty values")
-            
-            # Đảm bảo tất cả các cột hiện có có đủ số lượng phần tử
-            for key in all_combined_data:
-                while len(all_combined_data[key]) < total_rows_processed:
-                    all_combined_data[key].append('')
-            
-            # Thêm dữ liệu từ URL hiện tại
-            for key, values in url_data.items():
-                all_combined_data[key].extend(values)
-            
-            # Điền giá trị rỗng cho các cột thiếu trong URL hiện tại
-            for key in missing_columns:
-                all_combined_data[key].extend([''] * url_row_count)
-            
-            # Update total rows processed
-            total_rows_processed += url_row_count
-            
-            # Đảm bảo tất cả các cột có cùng độ dài
-            max_length = max(len(v) for v in all_combined_data.values())
-            for key in all_combined_data:
-                while len(all_combined_data[key]) < max_length:
-                    all_combined_data[key].append('')
-                
-        except Exception as e:
-            print(f"Error processing URL {url}: {e}")
-        finally:
-            driver.quit()
+
+    def record(self, url, url_data, url_row_count):
+        entry = {
+            "url": url,
+            "status": "ok" if url_row_count else "failed",
+            "rows": url_row_count,
+            "data": url_data,
+            "time": time.time(),
+        }
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def completed_urls(self):
+        """Các URL có kết quả ok gần nhất (URL failed sẽ được chạy lại)"""
+        status = {}
+        for entry in self._read():
+            status[entry["url"]] = entry["status"]
+        return {url for url, state in status.items() if state == "ok"}
+
+    def _latest_offsets(self):
+        """{url: vị trí (byte) dòng ok mới nhất trong file}; chỉ giữ offset, không giữ data"""
+        offsets = {}
+        if not os.path.exists(self.path):
+            return offsets
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    entry = None
+                if entry is not None:
+                    if entry["status"] == "ok":
+                        offsets[entry["url"]] = offset
+                    else:
+                        offsets.pop(entry["url"], None)
+                offset += len(line)
+        return offsets
+
+    def iter_results(self, urls=None):
+        """Kết quả ok mới nhất của mỗi URL, theo thứ tự urls (hoặc thứ tự trong file), đọc từng URL một từ file"""
+        offsets = self._latest_offsets()
+        if not offsets:
+            return
+        order = urls if urls is not None else list(offsets)
+        with open(self.path, "rb") as f:
+            for url in order:
+                if url not in offsets:
+                    continue
+                f.seek(offsets[url])
+                entry = json.loads(f.readline())
+                yield url, entry["data"], entry["rows"]
+
+    def load_results(self, urls=None):
+        return list(self.iter_results(urls))
+
+    def reset(self):
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+class StoredResults:
+    """Kết quả đã lưu (checkpoint / hàng đợi), mỗi lần duyệt đọc lại từng URL từ nơi lưu
+
+    Duyệt được nhiều lần (export rồi fan-out) mà không giữ data của mọi URL trong RAM.
+    """
+
+    def __init__(self, store, urls=None):
+        self.store = store
+        self.urls = urls
+
+    def __iter__(self):
+        return self.store.iter_results(self.urls)
+
+def crawl_urls(urls, num_workers=NUM_WORKERS, checkpoint=None):
+    """Crawl danh sách URL bằng async engine, trả kết quả theo thứ tự input
+
+    Nếu có checkpoint: ghi từng kết quả ngay khi xong, bỏ qua URL đã xong khi RESUME
+    """
+    pending = urls
+    if checkpoint is not None:
+        if RESUME:
+            done = checkpoint.completed_urls()
+            pending = [url for url in urls if url not in done]
+            print(f"Resume: {len(urls) - len(pending)} URL đã xong, còn {len(pending)} URL")
+        else:
+            checkpoint.reset()
+
+    pool = DriverPool(size=num_workers)
+    try:
+        with MemoryWatchdog(pool):
+            results = asyncio.run(crawl_urls_async(
+                pending, make_url_fetcher(pool), max_in_flight=num_workers,
+                on_result=checkpoint.record if checkpoint is not None else None,
+                keep_results=checkpoint is None,
+            ))
+    finally:
+        pool.close()
+        SELECTOR_REGISTRY.save()
+
+    if checkpoint is not None:
+        # Dữ liệu đã nằm trong checkpoint: đọc lại từng URL khi duyệt thay vì giữ cả list trong RAM
+        return StoredResults(checkpoint, urls)
+    return [(url, *results[i]) for i, url in enumerate(pending) if results[i]]
+
+# ====== HÀNG ĐỢI URL CHO NHIỀU WORKER PROCESS (MỘT MÁY) ======
+class SQLiteWorkQueue:
+    """Hàng đợi URL có lease / visibility timeout / dead-letter, lưu trong một file SQLite
+
+    Chỉ dùng chung giữa các process trên cùng một máy, file phải nằm trên ổ local (WAL không chạy trên ổ mạng).
+    path=":memory:" là bản chạy trong process (dùng để thử, không chia sẻ giữa các process).
+    Trạng thái: pending -> leased -> done | pending (retry) | dead.
+    """
+
+    def __init__(self, path=":memory:", visibility_timeout=None, max_attempts=None):
+        self.path = path
+        self.visibility_timeout = QUEUE_VISIBILITY_TIMEOUT if visibility_timeout is None else visibility_timeout
+        self.max_attempts = QUEUE_MAX_ATTEMPTS if max_attempts is None else max_attempts
+        # isolation_level=None: tự quản lý transaction bằng BEGIN IMMEDIATE để lease là nguyên tử giữa các process
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    url TEXT PRIMARY KEY,
+                    seq INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    available_at REAL NOT NULL DEFAULT 0,
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    last_error TEXT,
+                    rows INTEGER NOT NULL DEFAULT 0,
+                    data TEXT,
+                    updated REAL
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, available_at, seq)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def publish(self, urls, run_id=None, reuse=False):
+        """Thêm URL vào hàng đợi, trả về số URL mới
+
+        Hàng đợi đang thuộc run_id khác (hoặc run_id=None) thì xóa hết rồi publish lại, để lần chạy mới
+        không xuất lại kết quả cũ; cùng run_id (worker khác của cùng lần chạy) hoặc reuse=True thì
+        URL đã có giữ nguyên trạng thái.
+        """
+        with self._transaction() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'run_id'").fetchone()
+            if not reuse and (run_id is None or row is None or row[0] != run_id):
+                conn.execute("DELETE FROM tasks")
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('run_id', ?)", (run_id,))
+            start = conn.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM tasks").fetchone()[0]
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO tasks (url, seq, updated) VALUES (?, ?, ?)",
+                ((url, start + i, time.time()) for i, url in enumerate(urls)),
+            )
+            return conn.total_changes - before
+
+    def lease(self, worker_id):
+        """Nhận một URL để xử lý trong visibility_timeout giây, trả về (url, attempt) hoặc None"""
+        now = time.time()
+        with self._transaction() as conn:
+            # Lease hết hạn mà đã dùng hết số lần thử: worker chết liên tục trên URL này
+            conn.execute(
+                "UPDATE tasks SET status = 'dead', last_error = 'lease expired', lease_owner = NULL, updated = ? "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            row = conn.execute(
+                "SELECT url, attempts FROM tasks "
+                "WHERE (status = 'pending' AND available_at <= ?) OR (status = 'leased' AND lease_expires < ?) "
+                "ORDER BY seq LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if row is None:
+                return None
+            url, attempts = row
+            conn.execute(
+                "UPDATE tasks SET status = 'leased', attempts = ?, lease_owner = ?, lease_expires = ?, updated = ? "
+                "WHERE url = ?",
+                (attempts + 1, worker_id, now + self.visibility_timeout, now, url),
+            )
+            return url, attempts + 1
+
+    def complete(self, url, url_data, url_row_count):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = 'done', rows = ?, data = ?, lease_owner = NULL, last_error = NULL, "
+                "updated = ? WHERE url = ?",
+                (url_row_count, json.dumps(url_data, ensure_ascii=False), time.time(), url),
+            )
+
+    def fail(self, url, worker_id, error=None, retry=True):
+        """Trả URL về hàng đợi sau backoff, hoặc chuyển vào dead-letter nếu đã hết số lần thử / retry=False"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT attempts FROM tasks WHERE url = ? AND status = 'leased' AND lease_owner = ?",
+                (url, worker_id),
+            ).fetchone()
+            if row is None:
+                # Lease đã hết hạn và worker khác đang giữ URL
+                return
+            attempts = row[0]
+            status = "dead" if not retry or attempts >= self.max_attempts else "pending"
+            conn.execute(
+                "UPDATE tasks SET status = ?, available_at = ?, lease_owner = NULL, last_error = ?, updated = ? "
+                "WHERE url = ?",
+                (status, now + backoff_delay(attempts - 1), error, now, url),
+            )
+
+    def stats(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+
+    def has_unfinished(self):
+        counts = self.stats()
+        return bool(counts.get("pending") or counts.get("leased"))
+
+    def dead_letters(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT url, attempts, last_error FROM tasks WHERE status = 'dead' ORDER BY seq").fetchall()
+
+    def requeue_dead(self):
+        """Cho các URL trong dead-letter chạy lại từ đầu"""
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.execute("UPDATE tasks SET status = 'pending', attempts = 0, available_at = 0, last_error = NULL "
+                         "WHERE status = 'dead'")
+            return conn.total_changes - before
+
+    def iter_results(self, urls=None):
+        """Kết quả các URL đã xong, theo thứ tự urls (hoặc thứ tự publish), đọc từng URL một"""
+        if urls is None:
+            with self._lock:
+                urls = [url for (url,) in self._conn.execute(
+                    "SELECT url FROM tasks WHERE status = 'done' ORDER BY seq")]
+        for url in urls:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT data, rows FROM tasks WHERE url = ? AND status = 'done'", (url,)).fetchone()
+            if row:
+                yield url, json.loads(row[0]), row[1]
+
+    def results(self, urls=None):
+        return list(self.iter_results(urls))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+async def run_queue_worker_async(work_queue, fetch, worker_id, concurrency=NUM_WORKERS, rate_limiter=None):
+    """Lease URL từ hàng đợi và chạy fetch(url) với tối đa concurrency URL cùng lúc, đến khi hàng đợi hết việc"""
+    rate_limiter = rate_limiter or HostRateLimiter()
+    processed = 0
+
+    async def run(slot):
+        nonlocal processed
+        slot_id = f"{worker_id}/{slot}"
+        while True:
+            leased = await asyncio.to_thread(work_queue.lease, slot_id)
+            if leased is None:
+                if not await asyncio.to_thread(work_queue.has_unfinished):
+                    return
+                # Còn URL đang chờ backoff hoặc đang do worker khác giữ
+                await asyncio.sleep(QUEUE_POLL_INTERVAL)
+                continue
+            url, attempt = leased
+            await rate_limiter.acquire(url)
+            print(f"[{slot_id}] Processing URL (attempt {attempt}): {url}")
+            error = None
+            try:
+                url_data, url_row_count = await asyncio.to_thread(fetch, url)
+            except SkipPage as e:
+                print(f"Skipping URL {url}: {e}")
+                await asyncio.to_thread(work_queue.fail, url, slot_id, str(e), False)
+                processed += 1
+                continue
+            except Exception as e:
+                print(f"Error processing URL {url}: {e}")
+                url_data, url_row_count, error = {}, 0, str(e)
+            if url_row_count:
+                await asyncio.to_thread(work_queue.complete, url, url_data, url_row_count)
+            else:
+                await asyncio.to_thread(work_queue.fail, url, slot_id, error or "no rows")
+            processed += 1
+
+    await asyncio.gather(*(run(slot) for slot in range(max(1, concurrency))))
+    return processed
+
+def run_queue_worker(work_queue, num_workers=NUM_WORKERS, worker_id=None):
+    """Một worker process: dùng num_workers Chrome để xử lý URL từ hàng đợi chung"""
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    pool = DriverPool(size=num_workers)
+    try:
+        with MemoryWatchdog(pool):
+            processed = asyncio.run(run_queue_worker_async(
+                work_queue, make_url_fetcher(pool), worker_id, concurrency=num_workers))
+    finally:
+        pool.close()
+        SELECTOR_REGISTRY.save()
+    print(f"Worker {worker_id} processed {processed} URL, queue: {work_queue.stats()}")
+    for url, attempts, last_error in work_queue.dead_letters():
+        print(f"⚠ Dead-letter after {attempts} attempts: {url} ({last_error})")
+    return processed
+
+# ====== FAN-OUT: MỞ LINK CHI TIẾT TỪNG PART NUMBER ======
+class BloomFilter:
+    """Tập URL đã gặp với bộ nhớ cố định; có thể báo nhầm "đã gặp" với xác suất error_rate"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    def add(self, item):
+        """Thêm item, trả về False nếu item đã có"""
+        added = False
+        for pos in self._positions(item):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                self.bits[pos >> 3] |= 1 << (pos & 7)
+                added = True
+        self.count += added
+        return added
+
+def select_part_links(results, seen, max_links_per_page=None):
+    """Link chi tiết chưa gặp trên mỗi trang (tối đa max_links_per_page), trả về {link: URL trang cha}"""
+    max_links_per_page = FOLLOW_MAX_LINKS_PER_PAGE if max_links_per_page is None else max_links_per_page
+    selected = {}
+    for url, url_data, _ in results:
+        taken = 0
+        for link in url_data.get('Part Link', []):
+            if taken >= max_links_per_page:
+                break
+            if not link:
+                continue
+            link = normalize_product_url(link)
+            if seen.add(link):
+                selected[link] = url
+                taken += 1
+    return selected
+
+def filter_variant_rows(link, url_data):
+    """Trang ?HissuCode=X vẫn render cả bảng của sản phẩm: chỉ giữ row của part number X
+
+    Trả về (url_data, số rows); link không có HissuCode thì giữ nguyên.
+    """
+    part_number = dict(parse_qsl(urlparse(link).query)).get("HissuCode")
+    part_numbers = url_data.get('Part Number')
+    if not part_number or not part_numbers:
+        return url_data, max((len(values) for values in url_data.values()), default=0)
+    keep = [i for i, value in enumerate(part_numbers) if value == part_number]
+    if not keep:
+        print(f"⚠ Part number {part_number} not found on {link}")
+    variant_data = {
+        key: [values[i] if i < len(values) else '' for i in keep]
+        for key, values in url_data.items()
+    }
+    return variant_data, len(keep)
+
+def follow_part_links(results, name_file_to_save, num_workers=NUM_WORKERS, max_depth=None, max_links_per_page=None):
+    """Crawl link chi tiết của các part number theo từng tầng, trả về kết quả các trang part
+
+    Mỗi tầng có file checkpoint riêng (<name>_variants_d<tầng>.progress.jsonl) nên chạy lại được.
+    """
+    max_depth = FOLLOW_MAX_DEPTH if max_depth is None else max_depth
+    seen = BloomFilter(FOLLOW_BLOOM_CAPACITY, FOLLOW_BLOOM_ERROR_RATE)
+    for url, _, _ in results:
+        seen.add(normalize_product_url(url))
+    variant_results = []
+    level = results
+    for depth in range(1, max_depth + 1):
+        parents = select_part_links(level, seen, max_links_per_page)
+        if not parents:
+            break
+        print(f"Fan-out depth {depth}: {len(parents)} part detail links")
+        checkpoint = RunCheckpoint(f"{name_file_to_save}_variants_d{depth}.progress.jsonl")
+        level = []
+        for url, url_data, _ in crawl_urls(list(parents), num_workers, checkpoint):
+            url_data, url_row_count = filter_variant_rows(url, url_data)
+            if not url_row_count:
+                continue
+            url_data['Parent URL'] = [parents[url]] * url_row_count
+            level.append((url, url_data, url_row_count))
+        variant_results.extend(level)
+    return variant_results
+
+@profiled("merge")
+def merge_results(results):
+    """Gộp kết quả các URL (hợp các cột), trả về (DataFrame, total_rows_processed)"""
+    accumulator = ColumnarAccumulator()
+    for url, url_data, url_row_count in results:
+        if url_row_count == 0:
+            continue
+        print(f"Extracted {url_row_count} rows from URL")
+        
+        # In thông tin chi tiết về quá trình xử lý
+        print_data_processing_info(url, url_data, accumulator.columns, accumulator.total_rows, url_row_count)
+        accumulator.add(url, url_data, url_row_count)
+    df = accumulator.to_frame()
+    if SPEC_NUMERIC_COLUMNS:
+        df = normalize_spec_columns(df)
+    if TYPED_COLUMNS:
+        df = to_typed_frame(df)
+    return df, accumulator.total_rows
+
+# ====== GHI FILE OUTPUT ======
+def write_xlsx_streaming(df, output_file):
+    """Ghi xlsx bằng workbook write-only của openpyxl (không giữ cả sheet trong bộ nhớ)"""
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append([str(col) for col in df.columns])
+    for row in df.itertuples(index=False, name=None):
+        # NaN của các cột số ghi thành ô trống
+        sheet.append([None if value != value else value for value in row])
+    workbook.save(output_file)
+
+OUTPUT_WRITERS = {
+    "xlsx": (".xlsx", lambda df, path: df.to_excel(path, index=False)),
+    "xlsx-stream": (".xlsx", write_xlsx_streaming),
+    "csv": (".csv", lambda df, path: df.to_csv(path, index=False, encoding="utf-8-sig")),
+    "parquet": (".parquet", lambda df, path: df.to_parquet(path, index=False)),
+    "feather": (".feather", lambda df, path: df.reset_index(drop=True).to_feather(path)),
+}
+
+@profiled("export")
+def write_output(df, name_file_to_save, output_format=None):
+    """Ghi df theo định dạng đã chọn, trả về đường dẫn file"""
+    output_format = output_format or OUTPUT_FORMAT
+    if output_format not in OUTPUT_WRITERS:
+        raise ValueError(f"Unknown output format: {output_format} (choose from {list(OUTPUT_WRITERS)})")
+    extension, writer = OUTPUT_WRITERS[output_format]
+    output_file = name_file_to_save + extension
+    writer(df, output_file)
+    return output_file
+
+OUTPUT_READERS = {
+    ".xlsx": lambda path: pd.read_excel(path, dtype=str),
+    ".csv": lambda path: pd.read_csv(path, dtype=str, keep_default_na=False, encoding="utf-8-sig"),
+    ".parquet": lambda path: pd.read_parquet(path),
+    ".feather": lambda path: pd.read_feather(path),
+}
+
+def load_output(path):
+    """Đọc lại một file output (theo đuôi file), mọi ô trống thành ''"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in OUTPUT_READERS:
+        raise ValueError(f"Unsupported output file: {path}")
+    return OUTPUT_READERS[extension](path).astype(object).fillna('').astype(str)
+
+def save_output(df, path):
+    """Ghi df ra path, chọn writer theo đuôi file"""
+    extension = os.path.splitext(path)[1].lower()
+    output_format = next(name for name, (ext, _) in OUTPUT_WRITERS.items() if ext == extension)
+    return write_output(df, os.path.splitext(path)[0], output_format)
+
+# ====== DIFF VỚI LẦN CHẠY TRƯỚC ======
+@profiled("diff")
+def diff_outputs(previous_df, current_df, key_columns=None, compare_columns=None):
+    """So sánh theo key (mặc định Part Number): trả về các dòng added / removed / changed
+
+    Mỗi cột so sánh có 2 cột <tên>_old và <tên>_new.
+    """
+    key_columns = key_columns or DIFF_KEY_COLUMNS
+    compare_columns = compare_columns or DIFF_COLUMNS
+
+    def prepare(df):
+        df = df.copy()
+        for col in compare_columns + ['Source_URL']:
+            if col not in df.columns:
+                df[col] = ''
+        df = df[key_columns + compare_columns + ['Source_URL']].astype(object).fillna('').astype(str)
+        df = df[(df[key_columns] != '').all(axis=1)]
+        return df.drop_duplicates(key_columns, keep="last")
+
+    merged = prepare(previous_df).merge(
+        prepare(current_df), on=key_columns, how="outer", suffixes=("_old", "_new"), indicator=True
+    )
+    for col in compare_columns + ['Source_URL']:
+        merged[[f"{col}_old", f"{col}_new"]] = merged[[f"{col}_old", f"{col}_new"]].fillna('')
+    changed = pd.Series(False, index=merged.index)
+    for col in compare_columns:
+        changed |= merged[f"{col}_old"] != merged[f"{col}_new"]
+
+    merged["Change"] = "changed"
+    merged.loc[merged["_merge"] == "right_only", "Change"] = "added"
+    merged.loc[merged["_merge"] == "left_only", "Change"] = "removed"
+    merged["Source_URL"] = merged["Source_URL_new"].where(merged["Source_URL_new"] != '', merged["Source_URL_old"])
+    delta = merged[(merged["_merge"] != "both") | changed]
+
+    value_columns = [f"{col}_{suffix}" for col in compare_columns for suffix in ("old", "new")]
+    return delta[key_columns + ["Change"] + value_columns + ["Source_URL"]].reset_index(drop=True)
+
+def write_diff(current_df, name_file_to_save, previous_path=None, output_format=None):
+    """Ghi <name>_delta với các dòng thay đổi so với lần chạy trước; trả về đường dẫn hoặc None
+
+    Lần chạy trước là <name>_baseline (cùng đuôi với previous_path) nếu đã có, nếu chưa thì previous_path.
+    Sau đó kết quả mới ghi đè <name>_baseline; previous_path của người dùng không bao giờ bị ghi.
+    """
+    previous_path = previous_path or DIFF_PREVIOUS_OUTPUT
+    baseline_path = name_file_to_save + "_baseline" + os.path.splitext(previous_path)[1]
+    if os.path.exists(baseline_path):
+        previous_path = baseline_path
+    if not os.path.exists(previous_path):
+        print(f"⚠ Previous output not found: {previous_path}, writing the first baseline {baseline_path}")
+        save_output(current_df, baseline_path)
+        return None
+    previous_df = load_output(previous_path)
+    missing_keys = [col for col in DIFF_KEY_COLUMNS if col not in previous_df.columns or col not in current_df.columns]
+    if missing_keys:
+        print(f"⚠ Cannot diff, key columns missing: {missing_keys}")
+        return None
+
+    delta = diff_outputs(previous_df, current_df)
+    counts = delta["Change"].value_counts().to_dict()
+    print(f"Diff vs {previous_path}: {counts.get('added', 0)} added, "
+          f"{counts.get('removed', 0)} removed, {counts.get('changed', 0)} changed")
+    output_file = write_output(delta, name_file_to_save + "_delta", output_format)
+    print(f"✅ Đã lưu thay đổi vào {output_file}")
+    save_output(current_df, baseline_path)
+    print(f"✅ Baseline mới: {baseline_path}")
+    return output_file
+
+def write_partitions(results, name_file_to_save, output_format=None, batch_size=None):
+    """Ghi mỗi batch batch_size URL ra một file trong thư mục <name>_parts, trả về list file"""
+    batch_size = batch_size or OUTPUT_PARTITION_SIZE
+    os.makedirs(name_file_to_save + "_parts", exist_ok=True)
+    output_files = []
+    # Chỉ giữ một batch trong RAM: results có thể là StoredResults đọc dần từ checkpoint
+    iterator = iter(results)
+    for part in itertools.count():
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            break
+        df, rows = merge_results(batch)
+        if rows == 0:
+            continue
+        part_name = os.path.join(name_file_to_save + "_parts", f"part-{part:05d}")
+        output_files.append(write_output(df, part_name, output_format))
+        print(f"✅ Đã lưu partition {output_files[-1]} ({rows} rows)")
+    return output_files
+
+def set_diff_previous(previous_path):
+    """Bật chế độ diff từ CLI; trả về False nếu không dùng được (đang ghi partition)"""
+    global DIFF_PREVIOUS_OUTPUT
+    DIFF_PREVIOUS_OUTPUT = previous_path or DIFF_PREVIOUS_OUTPUT
+    if DIFF_PREVIOUS_OUTPUT and OUTPUT_PARTITION_SIZE:
+        print("⚠ --diff-previous needs a single output file, set OUTPUT_PARTITION_SIZE = None")
+        return False
+    if DIFF_PREVIOUS_OUTPUT and os.path.splitext(DIFF_PREVIOUS_OUTPUT)[1].lower() not in OUTPUT_READERS:
+        print(f"⚠ Unsupported previous output: {DIFF_PREVIOUS_OUTPUT}")
+        return False
+    return True
+
+# ====== MAIN ======
+def export_results(results, name_file_to_save):
+    """Gộp kết quả các URL và ghi ra file theo OUTPUT_FORMAT"""
+    if OUTPUT_PARTITION_SIZE:
+        if DIFF_PREVIOUS_OUTPUT:
+            print("⚠ Diff mode is not supported with OUTPUT_PARTITION_SIZE, writing full partitions")
+        # Ghi từng batch URL ra file riêng, không cần gộp cả frame lớn
+        write_partitions(results, name_file_to_save, OUTPUT_FORMAT, OUTPUT_PARTITION_SIZE)
+        return
+    df, total_rows_processed = merge_results(results)
 
     print(f"Total rows processed: {total_rows_processed}")
-    print("Combined data keys:", list(all_combined_data.keys()))
+    print("Combined data keys:", list(df.columns))
 
     # Validate data consistency before saving
-    if not validate_data_consistency(all_combined_data):
+    if not validate_data_consistency(df):
         print("⚠ Dữ liệu không nhất quán, không thể lưu file")
         return
 
+    if DIFF_PREVIOUS_OUTPUT and total_rows_processed > 0:
+        # Chế độ diff: chỉ ghi các dòng thay đổi Price / Days to Ship thay vì cả workbook
+        write_diff(df, name_file_to_save, DIFF_PREVIOUS_OUTPUT, OUTPUT_FORMAT)
+        return
+
     # Save the accumulated data
-    if all_combined_data and total_rows_processed > 0:
-        df = pd.DataFrame(all_combined_data)
-        output_file = name_file_to_save+".xlsx"
-        df.to_excel(output_file, index=False)
+    if total_rows_processed > 0:
+        output_file = write_output(df, name_file_to_save, OUTPUT_FORMAT)
         print(f"✅ Đã lưu dữ liệu vào {output_file}")
         print(f"DataFrame shape: {df.shape}")
         
         # In thống kê về dữ liệu
         print("\nThống kê dữ liệu:")
-        for col in df.columns:
-            non_empty_count = (df[col] != '').sum()
+        for col, non_empty_count in fill_stats(df).items():
             print(f"  {col}: {non_empty_count}/{len(df)} rows có dữ liệu")
     else:
         print("⚠ Không lấy được dữ liệu nào.")
 
 
+# ====== CLI ======
+def parse_shard(value):
+    """"i/N" -> (i, N)"""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"shard must look like i/N, got {value!r}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in 0..{count - 1}")
+    return index, count
+
+def split_output_path(path, output_format=None):
+    """"out.xlsx" -> ("out", "xlsx"); đuôi file chọn định dạng nếu không chỉ định --format"""
+    name, extension = os.path.splitext(path)
+    formats = [fmt for fmt, (ext, _) in OUTPUT_WRITERS.items() if ext == extension.lower()]
+    if not formats:
+        return path, output_format or OUTPUT_FORMAT
+    return name, output_format or formats[0]
+
+def validate_urls(file_path):
+    """In thống kê URL trong file: số dòng, số URL trùng, các URL không phải trang sản phẩm"""
+    total = 0
+    seen = set()
+    invalid = []
+    for raw_url in iter_urls_from_file(file_path):
+        total += 1
+        url = normalize_product_url(raw_url)
+        seen.add(url)
+        if urlparse(url).scheme not in ("http", "https") or not re.search(PRODUCT_URL_PATTERN, url):
+            invalid.append(raw_url)
+    print(f"{total} URL, {len(seen)} unique after normalization, {total - len(seen)} duplicates")
+    for url in invalid:
+        print(f"⚠ Not a product URL: {url}")
+    return 1 if invalid else 0
+
+def load_saved_results(path):
+    """Kết quả đã có: file checkpoint .progress.jsonl hoặc hàng đợi SQLite"""
+    if path.endswith(".jsonl"):
+        return StoredResults(RunCheckpoint(path))
+    return StoredResults(SQLiteWorkQueue(path))
+
+def run_crawl(args):
+    global OUTPUT_FORMAT, FETCH_MODE, RESUME, FOLLOW_PART_LINKS
+    shard_index, num_shards = args.shard
+    name_file_to_save, OUTPUT_FORMAT = split_output_path(args.output, args.format)
+    FETCH_MODE = args.fetch_mode or FETCH_MODE
+    RESUME = RESUME or args.resume
+    FOLLOW_PART_LINKS = FOLLOW_PART_LINKS or args.follow_links
+    if not set_diff_previous(args.diff_previous):
+        return 1
+    urls = get_url_From_file(args.input, args.start, args.end, shard_index, num_shards)
+    if num_shards > 1:
+        name_file_to_save += f"_shard{shard_index}of{num_shards}"
+
+    queue_path = args.queue or WORK_QUEUE_PATH
+    if queue_path:
+        # Mọi worker process chạy cùng lệnh: publish (cùng run id thì URL đã có được bỏ qua) rồi cùng lấy việc
+        work_queue = SQLiteWorkQueue(queue_path)
+        run_id = args.run_id or QUEUE_RUN_ID or time.strftime("%Y-%m-%d")
+        print(f"Published {work_queue.publish(urls, run_id, reuse=RESUME)} new URL to {queue_path} (run {run_id})")
+        if args.requeue_dead:
+            print(f"Requeued {work_queue.requeue_dead()} dead-letter URL")
+        run_queue_worker(work_queue, args.workers)
+        if not args.export:
+            # Worker chỉ xử lý URL; output / fan-out do một process duy nhất ghi để không ghi đè lẫn nhau
+            print(f"Worker done. Export once with: {os.path.basename(sys.argv[0])} merge {queue_path} -o {args.output}"
+                  " (or run one worker with --export)")
+            PROFILER.print_summary()
+            PROFILER.write(f"{name_file_to_save}_worker{os.getpid()}")
+            return 0
+        # run_queue_worker chỉ trả về khi hàng đợi hết URL pending / leased, tức các worker khác đã xong
+        results = StoredResults(work_queue, urls)
+    else:
+        # Kết quả từng URL được ghi ngay vào file checkpoint, chạy lại sẽ chỉ làm các URL chưa xong
+        checkpoint = RunCheckpoint(name_file_to_save + ".progress.jsonl")
+        results = crawl_urls(urls, args.workers, checkpoint)
+    export_results(results, name_file_to_save)
+    if FOLLOW_PART_LINKS:
+        export_results(follow_part_links(results, name_file_to_save, args.workers), name_file_to_save + "_variants")
+
+    # Thời gian từng stage: in bảng tổng kết và ghi ra <name>.profile.json / .profile.csv
+    PROFILER.print_summary()
+    PROFILER.write(name_file_to_save)
+    return 0
+
+def run_urls(args):
+    if not os.path.exists(args.input):
+        print(f"⚠ File not found: {args.input}")
+        return 1
+    if args.validate:
+        return validate_urls(args.input)
+    shard_index, num_shards = args.shard
+    for url in iter_urls(args.input, max(0, args.start), args.end, shard_index, num_shards):
+        print(url)
+    return 0
+
+def run_merge(args):
+    global OUTPUT_FORMAT
+    name_file_to_save, OUTPUT_FORMAT = split_output_path(args.output, args.format)
+    if not set_diff_previous(args.diff_previous):
+        return 1
+    # Đọc dần từng file kết quả, không nạp tất cả vào RAM trước khi export
+    results = itertools.chain.from_iterable(load_saved_results(path) for path in args.results)
+    export_results(results, name_file_to_save)
+    return 0
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Scrape bảng Part Number các trang sản phẩm misumi-ec.com")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_url_arguments(command):
+        command.add_argument("input", help=f"file CSV (cột '{URL_COLUMN}') hoặc JSONL chứa URL sản phẩm")
+        command.add_argument("--start", type=int, default=0, help="vị trí URL đầu tiên (tính trên URL không trùng)")
+        command.add_argument("--end", type=int, help="vị trí sau URL cuối cùng (mặc định: hết file)")
+        command.add_argument("--shard", type=parse_shard, default=(SHARD_INDEX, NUM_SHARDS),
+                             help="i/N: chỉ lấy shard thứ i trong N shard")
+
+    def add_diff_argument(command):
+        command.add_argument("--diff-previous", metavar="FILE",
+                             help="output lần chạy trước: chỉ ghi các dòng thay đổi ra <output>_delta, "
+                                  "từ lần sau so với <output>_baseline")
+
+    crawl = commands.add_parser("crawl", help="scrape các URL trong file input")
+    add_url_arguments(crawl)
+    crawl.add_argument("-o", "--output", required=True, help="file output (đuôi file chọn định dạng nếu không có --format)")
+    crawl.add_argument("-f", "--format", choices=list(OUTPUT_WRITERS))
+    crawl.add_argument("-w", "--workers", type=int, default=NUM_WORKERS, help="số Chrome chạy song song")
+    crawl.add_argument("--fetch-mode", choices=["browser", "http"])
+    crawl.add_argument("--queue", help="file SQLite (ổ local) làm hàng đợi URL dùng chung giữa các worker process trên cùng máy")
+    crawl.add_argument("--follow-links", action="store_true", help="mở thêm link chi tiết của từng part number")
+    crawl.add_argument("--run-id", help="với --queue: worker cùng run id dùng chung hàng đợi, run id mới thì "
+                                        "xóa hàng đợi cũ (mặc định: ngày hôm nay)")
+    crawl.add_argument("--requeue-dead", action="store_true", help="với --queue: chạy lại các URL trong dead-letter")
+    crawl.add_argument("--export", action="store_true",
+                       help="với --queue: process điều phối, chờ hàng đợi xong rồi ghi output và chạy --follow-links")
+    crawl.add_argument("--resume", action="store_true", help="chạy tiếp lần chạy bị dừng: giữ kết quả trong file checkpoint / hàng đợi")
+    add_diff_argument(crawl)
+    crawl.set_defaults(handler=run_crawl)
+
+    urls = commands.add_parser("urls", help="in URL sau khi chuẩn hóa / bỏ trùng / chia shard")
+    add_url_arguments(urls)
+    urls.add_argument("--validate", action="store_true", help="chỉ kiểm tra: đếm URL trùng và URL không phải trang sản phẩm")
+    urls.set_defaults(handler=run_urls)
+
+    merge = commands.add_parser("merge", help="ghi file output từ kết quả đã có (checkpoint .progress.jsonl / hàng đợi SQLite)")
+    merge.add_argument("results", nargs="+")
+    merge.add_argument("-o", "--output", required=True)
+    merge.add_argument("-f", "--format", choices=list(OUTPUT_WRITERS))
+    add_diff_argument(merge)
+    merge.set_defaults(handler=run_merge)
+    return parser
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    return args.handler(args)
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
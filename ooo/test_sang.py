@@ -0,0 +1,182 @@
+import sang
+
+
+def merge(results):
+    accumulator = sang.ColumnarAccumulator()
+    for url, url_data in results:
+        accumulator.add(url, url_data, max(len(values) for values in url_data.values()))
+    return accumulator.to_frame()
+
+
+def test_case_only_headers_stay_separate_across_urls():
+    df = merge([
+        ("u1", {"d": ["10"], "D": ["30"]}),
+        ("u2", {"D": ["40"], "d": ["12"]}),
+        ("u3", {"D": ["50"]}),
+    ])
+    assert df["d"].tolist() == ["10", "12", ""]
+    assert df["D"].tolist() == ["30", "40", "50"]
+
+
+def test_whitespace_variants_share_a_column_without_clobbering():
+    df = merge([
+        ("u1", {"Bore Dia. d(mm)": ["10"]}),
+        ("u2", {"Bore Dia.  d (mm)": ["12"]}),
+        ("u3", {"Bore Dia. d (mm)": ["14"], "Bore Dia. d(mm)": ["16"]}),
+    ])
+    assert df["Bore Dia. d(mm)"].tolist() == ["10", "12", "14"]
+    assert df["Bore Dia. d(mm) (2)"].tolist() == ["", "", "16"]
+
+
+PRODUCT_URL = "https://jp.misumi-ec.com/vona2/detail/110300000000/"
+
+
+def page(**info):
+    return {"url": PRODUCT_URL, "title": "", "hasTabs": False, "hasChallenge": False, "text": "", **info}
+
+
+def test_classify_rendered_product_page():
+    assert sang.classify_page(page(hasTabs=True, text="captcha"))[0] == "product"
+
+
+def test_classify_loading_product_page_ignores_body_markers():
+    assert sang.classify_page(page(text="Just a moment... loading captcha widget"))[0] == "loading"
+
+
+def test_classify_challenge_from_dom_title_or_redirect():
+    assert sang.classify_page(page(hasChallenge=True))[0] == "blocked"
+    assert sang.classify_page(page(title="Just a moment..."))[0] == "blocked"
+    assert sang.classify_page(page(url="https://jp.misumi-ec.com/challenge", text="Verify you are human"))[0] == "blocked"
+
+
+def test_classify_error_and_non_product_pages():
+    assert sang.classify_page(page(title="502 Bad Gateway"))[0] == "error"
+    assert sang.classify_page(page(title="404 Not Found"))[0] == "not_product"
+    assert sang.classify_page(page(url="https://jp.misumi-ec.com/", title="MISUMI"))[0] == "not_product"
+
+
+class PagingDriver:
+    """Bảng không cuộn được, nút "next" đổi location.pathname sau khi bấm"""
+
+    def __init__(self, next_path):
+        self.path = "/vona2/detail/110300000000/"
+        self.next_path = next_path
+
+    def execute_script(self, script, *args):
+        if script == sang._FIND_NEXT_PAGE_JS:
+            return "next-button"
+        if "location.pathname" in script:
+            return self.path
+        if script.startswith("arguments[0].click()"):
+            self.path = self.next_path
+            return None
+        return False
+
+
+def test_advance_table_stops_when_next_leaves_the_page(monkeypatch):
+    monkeypatch.setattr(sang, "wait_for_stable_rows", lambda *args, **kwargs: True)
+    assert sang._advance_table(PagingDriver("/vona2/detail/110300000000/")) is True
+    assert sang._advance_table(PagingDriver("/vona2/mech/")) is False
+
+
+def test_spec_columns_with_one_unit_become_numeric():
+    import pandas as pd
+    df = pd.DataFrame({
+        "Part Number": ["A1", "A2", "A3"],
+        "Length": ["10mm", "12.5 mm", ""],
+        "Load": ["5N", "2kN", "3N"],
+        "Material": ["45C", "SUS304", "S45C"],
+        "Code": ["010", "020", "030"],
+    })
+    out = sang.normalize_spec_columns(df)
+    assert list(out.columns) == ["Part Number", "Length [mm]", "Load", "Material", "Code"]
+    assert out["Length [mm]"].tolist()[:2] == [10.0, 12.5]
+    assert pd.isna(out["Length [mm]"].iloc[2])
+    assert out["Load"].tolist() == ["5N", "2kN", "3N"]
+
+
+def test_diff_outputs_reports_added_removed_and_changed():
+    import pandas as pd
+    previous = pd.DataFrame({
+        "Source_URL": ["u1", "u1", "u1"],
+        "Part Number": ["A1", "A2", "A3"],
+        "Price": ["100", "200", "300"],
+        "Days to Ship": ["2", "2", "2"],
+    })
+    current = pd.DataFrame({
+        "Source_URL": ["u1", "u1", "u2"],
+        "Part Number": ["A1", "A2", "B1"],
+        "Price": ["100", "250", "400"],
+        "Days to Ship": ["2", "2", "5"],
+    })
+    delta = sang.diff_outputs(previous, current).set_index("Part Number")
+    assert delta["Change"].to_dict() == {"A2": "changed", "A3": "removed", "B1": "added"}
+    assert delta.loc["A2", ["Price_old", "Price_new"]].tolist() == ["200", "250"]
+    assert delta.loc["A3", "Price_new"] == ""
+    assert delta.loc["B1", "Source_URL"] == "u2"
+
+
+def test_diff_outputs_keeps_the_last_row_of_duplicate_keys():
+    import pandas as pd
+    previous = pd.DataFrame({"Part Number": ["A1"], "Price": ["100"], "Days to Ship": ["2"]})
+    current = pd.DataFrame({"Part Number": ["A1", "A1"], "Price": ["100", "120"], "Days to Ship": ["2", "2"]})
+    delta = sang.diff_outputs(previous, current)
+    assert delta[["Part Number", "Change", "Price_new"]].values.tolist() == [["A1", "changed", "120"]]
+
+
+def test_write_diff_advances_its_own_baseline(tmp_path):
+    import pandas as pd
+    previous_path = str(tmp_path / "previous.csv")
+    name = str(tmp_path / "out")
+
+    def run(price):
+        df = pd.DataFrame({"Source_URL": ["u1"], "Part Number": ["A1"], "Price": [price], "Days to Ship": ["2"]})
+        return sang.write_diff(df, name, previous_path, "csv")
+
+    assert run("100") is None
+    assert not (tmp_path / "previous.csv").exists()
+    assert sang.load_output(name + "_baseline.csv")["Price"].tolist() == ["100"]
+    run("120")
+    assert sang.load_output(name + "_delta.csv")["Price_old"].tolist() == ["100"]
+    run("150")
+    assert sang.load_output(name + "_delta.csv")["Price_old"].tolist() == ["120"]
+
+
+def test_queue_publish_resets_for_a_new_run_and_joins_the_same_run():
+    work_queue = sang.SQLiteWorkQueue(":memory:")
+    assert work_queue.publish(["u1", "u2"], "day1") == 2
+    url, _ = work_queue.lease("w1")
+    work_queue.complete(url, {"Part Number": ["A"]}, 1)
+    assert work_queue.publish(["u1", "u2"], "day1") == 0
+    assert work_queue.stats() == {"done": 1, "pending": 1}
+    assert work_queue.publish(["u1", "u2"], "day2", reuse=True) == 0
+    assert work_queue.stats() == {"done": 1, "pending": 1}
+    assert work_queue.publish(["u1", "u2"], "day3") == 2
+    assert work_queue.stats() == {"pending": 2}
+
+
+def test_queue_expired_lease_goes_dead_after_max_attempts():
+    work_queue = sang.SQLiteWorkQueue(":memory:", visibility_timeout=-1, max_attempts=2)
+    work_queue.publish(["u1"])
+    assert work_queue.lease("w1") == ("u1", 1)
+    # Worker w1 chết: lease hết hạn, w2 nhận lại URL
+    assert work_queue.lease("w2") == ("u1", 2)
+    assert work_queue.lease("w3") is None
+    assert work_queue.dead_letters() == [("u1", 2, "lease expired")]
+    assert work_queue.requeue_dead() == 1
+    assert work_queue.lease("w3") == ("u1", 1)
+
+
+def test_queue_fail_backs_off_and_ignores_other_owners():
+    work_queue = sang.SQLiteWorkQueue(":memory:", max_attempts=3)
+    work_queue.publish(["u1"])
+    assert work_queue.lease("w1") == ("u1", 1)
+    work_queue.fail("u1", "w2", "not my lease")
+    assert work_queue.stats() == {"leased": 1}
+    before = sang.time.time()
+    work_queue.fail("u1", "w1", "timeout")
+    available_at, last_error = work_queue._conn.execute(
+        "SELECT available_at, last_error FROM tasks WHERE url = 'u1'").fetchone()
+    assert available_at > before and last_error == "timeout"
+    assert work_queue.stats() == {"pending": 1}
+    assert work_queue.lease("w1") is None